@@ -0,0 +1,98 @@
+"""
+Benchmarks for the start of the application and for the write throughput of the database.
+
+Usage: python benchmarks.py
+Every measurement runs in a fresh interpreter with HOME pointing to an empty temporary directory,
+so constants.MAIN_DB_PATH doesn't exist beforehand and nothing is cached between the runs.
+"""
+
+import os
+import sys
+import subprocess
+import tempfile
+
+INCLUDE_DIR = os.path.dirname(os.path.abspath(__file__))
+PATH_DIRS = [INCLUDE_DIR] + [os.path.join(INCLUDE_DIR, name) for name in ("misc", "db_management", "ui")]
+
+
+def run_timed(code, home, runs):
+    """
+    Runs code in fresh interpreters and returns the best of the measured times in milliseconds.
+    The code has to print the measured time in seconds as last line.
+    """
+
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["PYTHONPATH"] = os.pathsep.join(PATH_DIRS)
+    times = []
+    for run in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], env = env, cwd = os.path.join(INCLUDE_DIR, "ui"),
+                                stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        times.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return min(times), None
+
+
+def startup_benchmark(runs = 5):
+    """
+    Measures the cold start: importing the modules, and opening the main database on first use.
+    Also checks that the imports alone don't create the database.
+    """
+
+    import_code = "import time\nt = time.perf_counter()\nimport {}\nprint(time.perf_counter() - t)"
+    open_code = "import db_session, time\nt = time.perf_counter()\ndb_session.get_db()\nprint(time.perf_counter() - t)"
+
+    for name, modules in (("db modules", "db_interface, collection_interface, db_session"),
+                          ("ui modules", "db_ui, entry_dialog")):
+        with tempfile.TemporaryDirectory() as home:
+            best, error = run_timed(import_code.format(modules), home, runs)
+            if error:
+                print("import {:<12} skipped ({})".format(name, error))
+                continue
+            db_path = os.path.join(home, "ScoreCabinet", "main.db")
+            print("import {:<12} {:8.1f} ms   database touched: {}".format(name, best, os.path.exists(db_path)))
+
+    with tempfile.TemporaryDirectory() as home:
+        best, error = run_timed(open_code, home, 1)
+        print("first get_db() (new db) {:8.1f} ms".format(best) if not error else "get_db() failed ({})".format(error))
+        best, error = run_timed(open_code, home, runs)
+        print("first get_db() (existing db) {:8.1f} ms".format(best) if not error else
+              "get_db() failed ({})".format(error))
+
+
+def commit_benchmark(edits = 500, runs = 3):
+    """
+    Measures how many single-row writes per second are possible, committing every write on its own versus grouping
+    all of them with DbHandler.batch(), for the rollback journal of sqlite ('legacy') and the profiles in WAL mode.
+    """
+
+    code = "\n".join(["import db_interface, time",
+                      "db = db_interface.DbHandler({path!r}, {profile!r})",
+                      "db.create_table('edits', [('edit_id', 'INTEGER PRIMARY KEY'), ('value', 'TEXT')])",
+                      "t = time.perf_counter()",
+                      "if {batched}:",
+                      "    with db.batch():",
+                      "        for i in range({edits}):",
+                      "            db.insert_into_table('edits', {{'value': str(i)}})",
+                      "else:",
+                      "    for i in range({edits}):",
+                      "        db.insert_into_table('edits', {{'value': str(i)}})",
+                      "print(time.perf_counter() - t)"])
+
+    for profile in ("legacy", "durable", "default"):
+        for batched in (False, True):
+            with tempfile.TemporaryDirectory() as home:
+                path = os.path.join(home, "commits.db")
+                best, error = run_timed(code.format(path = path, profile = profile, batched = batched, edits = edits),
+                                        home, runs)
+            mode = "batch()" if batched else "single commits"
+            if error:
+                print("{:<8} {:<15} failed ({})".format(profile, mode, error))
+                continue
+            print("{:<8} {:<15} {:8.1f} ms   {:10.0f} writes/s".format(profile, mode, best, edits / best * 1000))
+
+
+if __name__ == "__main__":
+    startup_benchmark()
+    commit_benchmark()
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import constants
+import db_interface
+import collection_interface
+
+
+class DbCall:
+    """
+    One call of a handler method on a worker thread of an AsyncTrackDbHandler.
+    Keeps track of the connection the call runs on, so a running statement can be interrupted when it is cancelled.
+    While the call runs, a progress handler aborts every further statement of a cancelled call as well, since an
+    interrupt only reaches the statement running at that moment.
+    """
+
+    def __init__(self, db, function, args, kwargs):
+        self.db = db
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def run(self):
+        with self.lock:
+            if self.cancelled:
+                return None
+            self.connection = self.db.db_connection
+        connection = self.connection
+        connection.set_progress_handler(self.check_cancelled, constants.DB_CANCEL_CHECK_INTERVAL)
+        try:
+            return self.function(*self.args, **self.kwargs)
+        finally:
+            connection.set_progress_handler(None, 0)
+            with self.lock:
+                self.connection = None
+
+    def check_cancelled(self):
+        """
+        The progress handler of the connection, a nonzero result makes sqlite abort the running statement.
+        """
+
+        return 1 if self.cancelled else 0
+
+    def cancel(self):
+        """
+        Prevents the call from starting or, if it already runs, interrupts its current statement and aborts the
+        following ones. An interrupted write transaction is rolled back by DbHandler.transaction().
+        """
+
+        with self.lock:
+            self.cancelled = True
+            if self.connection is not None:
+                self.connection.interrupt()
+
+
+class AsyncTrackDbHandler:
+    """
+    Runs the methods of a TrackDbHandler and of CollectionHandlers on worker threads, so they can be awaited from
+    an asyncio event loop without blocking it.
+    Reads run on a pool of reader threads, writes on a single writer thread, each thread with its own connection.
+    The amount of calls waiting for a thread is bounded: further callers wait in the event loop until a slot is free,
+    so a burst of requests doesn't pile up in front of the writer.
+    Cancelling an awaiting task cancels the call, see DbCall.cancel().
+    Opening the database runs DDL and migrations, so it happens on the writer thread as well:
+
+        async with AsyncTrackDbHandler(db_name) as db:
+            ...
+
+    or db = await AsyncTrackDbHandler.open(db_name) followed by await db.aclose().
+    """
+
+    def __init__(self, db_name = constants.MAIN_DB_PATH, max_readers = 4, max_pending_reads = 64,
+                 max_pending_writes = 16):
+        """
+        @param db_name: The path of the database. The handler opens its own TrackDbHandler and connections,
+        on the writer thread when it is started.
+        @param max_readers: The amount of threads running reads in parallel.
+        @param max_pending_reads: The maximal amount of reads submitted to the reader threads at once.
+        @param max_pending_writes: The maximal amount of writes submitted to the writer thread at once.
+        """
+
+        self.db_name = db_name
+        self.db = None
+        self.readers = ThreadPoolExecutor(max_workers = max_readers, thread_name_prefix = "db-reader")
+        self.writer = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "db-writer")
+        self.max_pending_reads = max_pending_reads
+        self.max_pending_writes = max_pending_writes
+        #Created on first use, inside the event loop they belong to.
+        self.read_slots = None
+        self.write_slots = None
+
+    @classmethod
+    async def open(cls, *args, **kwargs):
+        """
+        Creates a handler and opens its database without blocking the event loop. See __init__() for the parameters.
+        """
+
+        handler = cls(*args, **kwargs)
+        await handler.start()
+        return handler
+
+    async def start(self):
+        """
+        Opens the TrackDbHandler on the writer thread. Has to be awaited before any other method is called.
+        """
+
+        await asyncio.get_running_loop().run_in_executor(self.writer, self.open_db)
+
+    def open_db(self):
+        #Only runs on the single writer thread, so the handler is never opened twice.
+        if self.db is None:
+            self.db = db_interface.TrackDbHandler(self.db_name)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def run(self, function, *args, write = False, **kwargs):
+        """
+        Calls function(*args, **kwargs) on a worker thread and returns its result.
+
+        @param function: A method of self.db or any function using it.
+        @param write: If this is true, the call runs on the writer thread, otherwise on a reader thread.
+        """
+
+        if self.read_slots is None:
+            self.read_slots = asyncio.Semaphore(self.max_pending_reads)
+            self.write_slots = asyncio.Semaphore(self.max_pending_writes)
+        slots, executor = (self.write_slots, self.writer) if write else (self.read_slots, self.readers)
+
+        async with slots:
+            call = DbCall(self.db, function, args, kwargs)
+            future = asyncio.get_running_loop().run_in_executor(executor, call.run)
+            try:
+                return await future
+            except asyncio.CancelledError:
+                call.cancel()
+                raise
+
+    #Reads
+
+    async def get_entries(self, con_table = None, con_col = None, con_value = None):
+        return await self.run(self.db.get_entries, con_table, con_col, con_value)
+
+    async def search(self, query, limit = 50, offset = 0):
+        return await self.run(self.db.search, query, limit, offset)
+
+    async def fetch_table(self, table_name, **kwargs):
+        return await self.run(self.db.fetch_table, table_name, **kwargs)
+
+    #Writes
+
+    async def input_entries(self, *args):
+        return await self.run(self.db.input_entries, *args, write = True)
+
+    async def change_entry(self, entry):
+        return await self.run(self.db.change_entry, entry, write = True)
+
+    #Collections
+
+    async def get_collection(self, name, collection_id = None):
+        """
+        Returns the CollectionHandler of a collection, which is created if it doesn't exist yet.
+        Its methods must only be called through add_entries() and remove_entries() of this class.
+        """
+
+        return await self.run(collection_interface.CollectionHandler, name, self.db, collection_id, write = True)
+
+    async def add_entries(self, collection, entries):
+        return await self.run(collection.add_entries, list(entries), write = True)
+
+    async def remove_entries(self, collection, entries):
+        return await self.run(collection.remove_entries, list(entries), write = True)
+
+    def close(self):
+        """
+        Waits for the running calls and closes the connections of all the worker threads.
+        """
+
+        self.readers.shutdown(wait = True)
+        self.writer.shutdown(wait = True)
+        if self.db is not None:
+            self.db.pool.close_all()
+
+    async def aclose(self):
+        """
+        close() for the event loop: waits for the calls in a thread of the loop's default executor.
+        """
+
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
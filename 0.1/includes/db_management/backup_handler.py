@@ -0,0 +1,324 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import time
+
+from misc import constants, data_linking
+from misc.myExceptions import MissingSnapshotError, CorruptedBackupError
+
+
+class BackupHandler:
+    """
+    Creates incremental snapshots of the data directory.
+    The database is copied with the online backup API of sqlite, so it stays usable while the backup runs.
+    All other files are split into chunks which are stored under their SHA-256 hash, so identical content is stored
+    only once. Files whose size and mtime haven't changed since the last snapshot aren't even read again.
+    Every snapshot consists of the database copy and a manifest listing the chunks of every file.
+    """
+
+    def __init__(self, db, backup_directory = constants.BACKUP_DIRECTORY, linking_handler = None,
+                 chunk_size = constants.BACKUP_CHUNK_SIZE):
+        """
+        @param db: The DbHandler of the database to back up.
+        @param backup_directory: The directory the chunks and snapshots are stored in.
+        @param linking_handler: The LinkingHandler whose root directory is backed up.
+        @param chunk_size: The size of the chunks files are split into.
+        """
+
+        self.db = db
+        self.linking = linking_handler or data_linking.LinkingHandler()
+        self.root = os.path.abspath(self.linking.root)
+        self.backup_directory = os.path.abspath(backup_directory)
+        self.chunk_directory = os.path.join(self.backup_directory, "chunks")
+        self.snapshot_directory = os.path.join(self.backup_directory, "snapshots")
+        self.chunk_size = chunk_size
+        self.cancel_event = threading.Event()
+        self.thread = None
+        #Held by backup() and prune(). A running backup stores chunks no manifest lists yet, which prune() would delete.
+        self.lock = threading.Lock()
+
+    #Backup
+
+    def backup(self, progress = None):
+        """
+        Creates a new snapshot. The snapshot only becomes visible once it is complete.
+
+        @param progress: A function called as progress(stage, done, total) with the stage 'database' (pages)
+        or 'files' (bytes).
+        @return: The name of the new snapshot or None if the backup was cancelled.
+        """
+
+        with self.lock:
+            return self.create_snapshot(progress)
+
+    def create_snapshot(self, progress = None):
+        self.cancel_event.clear()
+        name = time.strftime("%Y%m%d-%H%M%S")
+        while os.path.exists(os.path.join(self.snapshot_directory, name)):
+            name += "_"
+        temp_path = os.path.join(self.snapshot_directory, name + ".tmp")
+        os.makedirs(temp_path)
+
+        try:
+            self.backup_database(os.path.join(temp_path, "database.db"), progress)
+            files = self.backup_files(progress)
+            if files is None:
+                return None
+            with open(os.path.join(temp_path, "manifest.json"), "w") as manifest:
+                json.dump({"root": self.root, "chunk_size": self.chunk_size, "files": files}, manifest)
+            os.replace(temp_path, os.path.join(self.snapshot_directory, name))
+            return name
+        finally:
+            if os.path.isdir(temp_path):
+                shutil.rmtree(temp_path)
+
+    def backup_in_background(self, progress = None, finished = None):
+        """
+        Runs backup() in a background thread. The callbacks are called from that thread.
+
+        @param finished: A function called with the name of the snapshot (None if cancelled) when the backup ends.
+        """
+
+        def run():
+            name = self.backup(progress)
+            self.db.pool.close_connection()
+            if finished:
+                finished(name)
+
+        self.thread = threading.Thread(target = run, name = "backup", daemon = True)
+        self.thread.start()
+        return self.thread
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def backup_database(self, target_path, progress = None, pages = 256):
+        """
+        Copies the database page by page into target_path while it stays usable for other connections.
+        """
+
+        def report(status, remaining, total):
+            if progress:
+                progress("database", total - remaining, total)
+
+        target = sqlite3.connect(target_path)
+        try:
+            self.db.db_connection.backup(target, pages = pages, progress = report)
+        finally:
+            target.close()
+
+    def backup_files(self, progress = None):
+        """
+        Stores the chunks of all new or changed files and returns the file list of the manifest.
+        The entries of unchanged files are taken over from the latest snapshot.
+        """
+
+        previous = {}
+        snapshots = self.list_snapshots()
+        if snapshots:
+            previous = {entry["path"]: entry for entry in self.load_manifest(snapshots[-1])["files"]}
+
+        excluded = constants.LIBRARY_EXCLUDED_DIRECTORIES + [self.backup_directory]
+        #The database (and its journal files) is backed up with the backup API instead.
+        db_path = os.path.abspath(self.db.db_name)
+        files = [file for file in self.linking.get_files(self.root, None, excluded) if not file[0].startswith(db_path)]
+        total = sum(file[1] for file in files)
+        done = 0
+
+        entries = []
+        for path, size, mtime in files:
+            if self.cancel_event.is_set():
+                return None
+            relative_path = os.path.relpath(path, self.root)
+            entry = previous.get(relative_path)
+            if not entry or entry["size"] != size or entry["mtime"] != mtime:
+                try:
+                    chunks = self.store_file(path)
+                except OSError as e:
+                    print("{} couldn't be backed up: {}".format(path, e))
+                    continue
+                entry = {"path": relative_path, "size": size, "mtime": mtime, "chunks": chunks}
+            entries.append(entry)
+            done += size
+            if progress:
+                progress("files", done, total)
+        return entries
+
+    def store_file(self, path):
+        """
+        Splits a file into chunks and stores the chunks which aren't stored yet.
+
+        @return: The list of the chunk hashes of the file.
+        """
+
+        chunks = []
+        with open(path, "rb") as file:
+            for data in iter(lambda: file.read(self.chunk_size), b""):
+                chunk_hash = hashlib.sha256(data).hexdigest()
+                chunk_path = self.get_chunk_path(chunk_hash)
+                if not os.path.isfile(chunk_path):
+                    os.makedirs(os.path.dirname(chunk_path), exist_ok = True)
+                    temp_path = "{}.{}.tmp".format(chunk_path, threading.get_ident())
+                    with open(temp_path, "wb") as chunk_file:
+                        chunk_file.write(data)
+                    os.replace(temp_path, chunk_path)
+                chunks.append(chunk_hash)
+        return chunks
+
+    def get_chunk_path(self, chunk_hash):
+        return os.path.join(self.chunk_directory, chunk_hash[:2], chunk_hash)
+
+    #Snapshots
+
+    def list_snapshots(self):
+        """
+        Returns the names of all complete snapshots, the oldest first.
+        """
+
+        if not os.path.isdir(self.snapshot_directory):
+            return []
+        return sorted(name for name in os.listdir(self.snapshot_directory) if not name.endswith(".tmp"))
+
+    def load_manifest(self, snapshot):
+        manifest_path = os.path.join(self.snapshot_directory, snapshot, "manifest.json")
+        if not os.path.isfile(manifest_path):
+            raise MissingSnapshotError(snapshot)
+        with open(manifest_path) as manifest:
+            return json.load(manifest)
+
+    def list_files(self, snapshot):
+        """
+        Returns the paths (relative to the data directory) of all the files in a snapshot.
+        """
+
+        return [entry["path"] for entry in self.load_manifest(snapshot)["files"]]
+
+    def prune(self, keep = 10):
+        """
+        Deletes all but the newest keep snapshots and the chunks no remaining snapshot references.
+        Waits for a running backup to finish first.
+
+        @return: The amount of deleted chunks.
+        """
+
+        with self.lock:
+            return self.prune_snapshots(keep)
+
+    def prune_snapshots(self, keep):
+        snapshots = self.list_snapshots()
+        for snapshot in snapshots[:-keep] if keep else snapshots:
+            shutil.rmtree(os.path.join(self.snapshot_directory, snapshot))
+
+        referenced = set()
+        for snapshot in self.list_snapshots():
+            for entry in self.load_manifest(snapshot)["files"]:
+                referenced.update(entry["chunks"])
+
+        deleted = 0
+        if os.path.isdir(self.chunk_directory):
+            for directory in os.listdir(self.chunk_directory):
+                for chunk_hash in os.listdir(os.path.join(self.chunk_directory, directory)):
+                    if chunk_hash not in referenced:
+                        os.remove(os.path.join(self.chunk_directory, directory, chunk_hash))
+                        deleted += 1
+        return deleted
+
+    #Restore
+
+    def read_file(self, snapshot, path):
+        """
+        Streams a file out of a snapshot chunk by chunk, so it is never held in memory as a whole.
+        Every chunk is checked against its hash.
+
+        @param path: The path of the file relative to the data directory, see list_files().
+        @return: A generator yielding the content of the file as bytes-objects.
+        """
+
+        for entry in self.load_manifest(snapshot)["files"]:
+            if entry["path"] == path:
+                break
+        else:
+            raise MissingSnapshotError(snapshot, path)
+
+        for chunk_hash in entry["chunks"]:
+            try:
+                with open(self.get_chunk_path(chunk_hash), "rb") as chunk_file:
+                    data = chunk_file.read()
+            except OSError:
+                raise CorruptedBackupError(chunk_hash)
+            if hashlib.sha256(data).hexdigest() != chunk_hash:
+                raise CorruptedBackupError(chunk_hash)
+            yield data
+
+    def restore_file(self, snapshot, path, target_path = None):
+        """
+        Restores a single file out of a snapshot. The file is only replaced once it has been restored completely.
+
+        @param path: The path of the file relative to the data directory, see list_files().
+        @param target_path: Where the file is written to, per default its original location.
+        @return: True if the file was restored.
+        """
+
+        if not target_path:
+            target_path = os.path.join(self.root, path)
+        temp_path = target_path + ".restore"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok = True)
+            with open(temp_path, "wb") as target:
+                for data in self.read_file(snapshot, path):
+                    target.write(data)
+            os.replace(temp_path, target_path)
+            return True
+        except (MissingSnapshotError, CorruptedBackupError) as e:
+            print(e.message)
+        except OSError as e:
+            print("{} couldn't be restored: {}".format(path, e))
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+
+    def restore_database(self, snapshot, target_path):
+        """
+        Copies the database of a snapshot to target_path.
+        The open database isn't replaced, as its connections would keep using the old file.
+        """
+
+        source_path = os.path.join(self.snapshot_directory, snapshot, "database.db")
+        try:
+            if not os.path.isfile(source_path):
+                raise MissingSnapshotError(snapshot, "database.db")
+            source = sqlite3.connect(source_path)
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            return True
+        except MissingSnapshotError as e:
+            print(e.message)
+            return False
+
+    def restore_snapshot(self, snapshot, target_directory):
+        """
+        Restores all the files and the database of a snapshot into target_directory.
+
+        @return: The amount of restored files.
+        """
+
+        restored = 0
+        for path in self.list_files(snapshot):
+            if self.restore_file(snapshot, path, os.path.join(target_directory, path)):
+                restored += 1
+        self.restore_database(snapshot, os.path.join(target_directory, os.path.basename(self.db.db_name)))
+        return restored
+
+
+if __name__ == "__main__":
+    import db_interface
+
+    handler = BackupHandler(db_interface.TrackDbHandler(constants.MAIN_DB_PATH))
+    print("Snapshot {} created".format(handler.backup(lambda stage, done, total: print(stage, done, total))))
@@ -6,15 +6,23 @@ import db_interface
 
 
 class CollectionHandler:
-    def __init__(self, name, db):
+    def __init__(self, name, db, collection_id = None):
+        """
+        @param name: The name of the collection. A new collection is created if it doesn't exist yet.
+        @param db: The TrackDbHandler of the database containing the collection.
+        @param collection_id: The id of the collection, if it is already known. Saves the lookup by name.
+        """
 
         self.name = name
         self.db = db
         self.groups = []
 
-        self.id = None
-        self.update_collection_id()
+        self.id = collection_id
+        if self.id is None:
+            self.update_collection_id()
         self.groups = {}
+        #The amount of tracks per group member, e.g. {"Komponisten": {"Bach": 3}}
+        self.group_counts = {}
         self.update_groups()
 
     def update_collection_id(self):
@@ -34,47 +42,58 @@ class CollectionHandler:
         @param id_name: The column where the reference-id is stored inside 'tracks'.
         """
 
-        col_ids = []
-
+        cursor = self.db.db_connection.cursor()
         if not id_name:
             id_name = col_name.split("name")[0]+"id"
-        id_location = constants.TRACK_INSERT_COLS.index(id_name) + 1
-
-        entries = self.get_all_entries()
-        if entries:
-            for track in entries:
-                col_ids.append(track.data[id_location][1])
-
-        #Remove duplicates
-        col_ids = list(set(col_ids))
 
-
-        if len(col_ids) > 1:
-            sql = "SELECT {} FROM {} WHERE {} IN {}".format(col_name, group_table, id_name, tuple(col_ids))
-        elif len(col_ids) == 1:
-            sql = "SELECT {} FROM {} WHERE {} = '{}'".format(col_name, group_table, id_name, col_ids[0])
-        else:
-            return False
-
-        data = []
+        sql =   """
+                SELECT DISTINCT {0}.{1} FROM collections_tracks
+                    JOIN tracks ON tracks.track_id = collections_tracks.track_id
+                    JOIN {0} ON {0}.{2} = tracks.{2}
+                WHERE collections_tracks.collection_id = ?
+                ORDER BY {0}.{1}
+                """.format(group_table, col_name, id_name)
 
         with self.db.db_connection:
-            print(sql)
-            self.db.cursor.execute(sql)
-            result = self.db.cursor.fetchall()
-            for row in result:
-                data.append(row[0])
-        data.sort()
+            cursor.execute(sql, (self.id,))
+            data = [row[0] for row in cursor.fetchall()]
+        if not data:
+            return False
         return data
 
     def update_groups(self):
-        interpreters = self.get_groupmembers("interpreters", "interpreter_name")
-        composers = self.get_groupmembers("composers", "composer_name")
-        genres = self.get_groupmembers("genres", "genre_name")
+        """
+        Computes the members of all the groups in constants.COLLECTION_GROUPS and the amount of tracks per member
+        with one grouped query, without fetching the tracks themselves.
+        The members are stored in self.groups, the track counts in self.group_counts.
+        """
 
-        self.groups["Interpreten"] = interpreters
-        self.groups["Komponisten"] = composers
-        self.groups["Genres"] = genres
+        cursor = self.db.db_connection.cursor()
+        group_selects = []
+        for group_name, group_table, id_name, col_name in constants.COLLECTION_GROUPS:
+            group_selects.append("""
+                                 SELECT ? AS group_name, {0}.{2} AS member, COUNT(*) FROM collections_tracks
+                                     JOIN tracks ON tracks.track_id = collections_tracks.track_id
+                                     JOIN {0} ON {0}.{1} = tracks.{1}
+                                 WHERE collections_tracks.collection_id = ?
+                                 GROUP BY {0}.{2}
+                                 """.format(group_table, id_name, col_name))
+        sql = " UNION ALL ".join(group_selects) + " ORDER BY group_name, member"
+
+        parameters = []
+        for group in constants.COLLECTION_GROUPS:
+            parameters.extend((group[0], self.id))
+
+        group_counts = {group[0]: {} for group in constants.COLLECTION_GROUPS}
+        with self.db.db_connection:
+            cursor.execute(sql, parameters)
+            for group_name, member, count in cursor.fetchall():
+                group_counts[group_name][member] = count
+
+        self.group_counts = group_counts
+        for group_name in group_counts:
+            #Empty groups are False, as returned by get_groupmembers().
+            self.groups[group_name] = sorted(group_counts[group_name]) or False
 
         return self.groups
 
@@ -83,12 +102,13 @@ class CollectionHandler:
         Fetches all tracks from the 'tracks' table which have a connection with the collection.
         """
 
+        cursor = self.db.db_connection.cursor()
         sql_fetch_tids = "SELECT track_id FROM collections_tracks WHERE collection_id = {}".format(self.id)
         tids = []
         try:
             with self.db.db_connection:
-                self.db.cursor.execute(sql_fetch_tids)
-                for line in self.db.cursor.fetchall():
+                cursor.execute(sql_fetch_tids)
+                for line in cursor.fetchall():
                     tids.append(line[0])
 
             sql_fetch_tracks = "SELECT {} FROM {} WHERE tracks.track_id IN ".format(
@@ -98,8 +118,8 @@ class CollectionHandler:
             results = []
             with self.db.db_connection:
                 if tids:
-                    self.db.cursor.execute(sql_fetch_tracks, tuple(tids))
-                    for entry in self.db.cursor.fetchall():
+                    cursor.execute(sql_fetch_tracks, tuple(tids))
+                    for entry in cursor.fetchall():
                         results.append(db_interface.Entry(entry))
                 else:
                     return None
@@ -113,30 +133,131 @@ class CollectionHandler:
         Adds an entry to the collection.
 
         @entry: Member of the 'Entry'-class. Obtainable e.g. via TrackDbHandler.get_entries()
+        @return: True if the entry was added, False if it already was part of the collection.
         """
 
-        track_id = entry.get_track_id()
-        sql_check_dupl = "SELECT * FROM collections_tracks WHERE track_id = ? AND collection_id = ?"
-        with self.db.db_connection:
-            self.db.cursor.execute(sql_check_dupl, (track_id, self.id))
-            if not self.db.cursor.fetchall():
-                sql = "INSERT INTO collections_tracks VALUES (?, ?)"
-                self.db.cursor.execute(sql, (track_id, self.id))
-                self.update_groups()
-                return True
-            else:
-                return False
+        return self.add_entries([entry]) == 1
 
     def delete_entry(self, entry = None, track_id = None):
+        """
+        Removes an entry from the collection, either given as member of the 'Entry'-class or by its track_id.
+        """
 
         if entry:
             track_id = entry.get_track_id()
-        print(track_id)
-        sql = "DELETE FROM collections_tracks WHERE track_id = ? AND collection_id = ?"
-        with self.db.db_connection:
-            self.db.cursor.execute(sql, (track_id, self.id))
-            self.update_groups()
+        return self.remove_entries([track_id]) == 1
+
+    def add_entries(self, entries, chunk_size = 500):
+        """
+        Adds several entries to the collection in one transaction and updates the groups once it has committed.
 
+        @param entries: An iterable of members of the 'Entry'-class or of track_ids.
+        @param chunk_size: The maximal amount of track_ids per 'IN (...)'-query.
+        @return: The amount of entries which were added. Entries already part of the collection are skipped.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        track_ids = self.get_track_ids(entries)
+        with self.db.transaction():
+            members = self.get_members(track_ids, chunk_size)
+            new_ids = [track_id for track_id in track_ids if track_id not in members]
+            cursor.executemany("INSERT INTO collections_tracks (track_id, collection_id) VALUES (?, ?)",
+                               [(track_id, self.id) for track_id in new_ids])
+            group_changes = self.count_group_members(new_ids, chunk_size)
+            self.db.after_commit(lambda: self.change_group_counts(group_changes, 1))
+        return len(new_ids)
+
+    def remove_entries(self, entries, chunk_size = 500):
+        """
+        Removes several entries from the collection in one transaction and updates the groups once it has committed.
+
+        @param entries: An iterable of members of the 'Entry'-class or of track_ids.
+        @param chunk_size: The maximal amount of track_ids per 'IN (...)'-query.
+        @return: The amount of entries which were removed.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        track_ids = self.get_track_ids(entries)
+        with self.db.transaction():
+            members = self.get_members(track_ids, chunk_size)
+            old_ids = [track_id for track_id in track_ids if track_id in members]
+            cursor.executemany("DELETE FROM collections_tracks WHERE track_id = ? AND collection_id = ?",
+                               [(track_id, self.id) for track_id in old_ids])
+            group_changes = self.count_group_members(old_ids, chunk_size)
+            self.db.after_commit(lambda: self.change_group_counts(group_changes, -1))
+        return len(old_ids)
+
+    def get_track_ids(self, entries):
+        """
+        Returns the unique track_ids of entries in input order. Entries can be given as 'Entry' or as track_id.
+        """
+
+        track_ids = []
+        seen = set()
+        for entry in entries:
+            if isinstance(entry, db_interface.Entry):
+                entry = entry.get_track_id()
+            if entry not in seen:
+                seen.add(entry)
+                track_ids.append(entry)
+        return track_ids
+
+    def get_members(self, track_ids, chunk_size = 500):
+        """
+        Returns the set of track_ids out of track_ids which are part of the collection.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        members = set()
+        for start in range(0, len(track_ids), chunk_size):
+            chunk = track_ids[start:start+chunk_size]
+            sql = "SELECT track_id FROM collections_tracks WHERE collection_id = ? AND track_id IN " + \
+                  helper_functions.create_placeholders(len(chunk))
+            cursor.execute(sql, [self.id] + chunk)
+            members.update(row[0] for row in cursor.fetchall())
+        return members
+
+    def count_group_members(self, track_ids, chunk_size = 500):
+        """
+        Returns the amount of tracks out of track_ids per group member, e.g. {"Komponisten": {"Bach": 3}}.
+        Only reads the tracks themselves, so it doesn't matter whether they are part of the collection.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        group_cols = ["{}.{}".format(group[1], group[3]) for group in constants.COLLECTION_GROUPS]
+        group_changes = {}
+        for start in range(0, len(track_ids), chunk_size):
+            chunk = track_ids[start:start+chunk_size]
+            sql = "SELECT {} FROM {} WHERE tracks.track_id IN {}".format(", ".join(group_cols), constants.JOIN_COLS,
+                                                                        helper_functions.create_placeholders(len(chunk)))
+            cursor.execute(sql, chunk)
+            for row in cursor.fetchall():
+                for group, member in zip(constants.COLLECTION_GROUPS, row):
+                    if member is not None:
+                        counts = group_changes.setdefault(group[0], {})
+                        counts[member] = counts.get(member, 0) + 1
+        return group_changes
+
+    def change_group_counts(self, group_changes, change):
+        """
+        Updates self.group_counts and self.groups incrementally for tracks joining (change = 1)
+        or leaving (change = -1) the collection. Members whose count drops to 0 are removed from their group.
+        NOTE: Changes of the tracks themselves (e.g. a new composer) aren't tracked, update_groups() recomputes
+        everything from scratch.
+
+        @param group_changes: The amount of tracks per group member as returned by count_group_members().
+        """
+
+        for group_name, changes in group_changes.items():
+            counts = self.group_counts.setdefault(group_name, {})
+            for member, amount in changes.items():
+                count = counts.get(member, 0) + change * amount
+                if count > 0:
+                    counts[member] = count
+                else:
+                    counts.pop(member, None)
+            #Empty groups are False, as returned by get_groupmembers().
+            self.groups[group_name] = sorted(counts) or False
 
 if __name__ == "__main__":
     test = CollectionHandler("test", db_interface.TrackDbHandler(constants.MAIN_DB_PATH))
@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import constants
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A connection handed out by a ConnectionPool.
+    Used as context manager it only commits if no transaction of the pool is open on it, so a 'with db_connection:'
+    nested inside ConnectionPool.transaction() doesn't end the surrounding transaction early.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PooledConnection, self).__init__(*args, **kwargs)
+        #The amount of nested ConnectionPool.transaction()-blocks currently open on this connection.
+        self.transaction_depth = 0
+        #The lookup cache entries of rows written by the open transaction, {cache: {value: key}}. They are published
+        #to the caches when the transaction commits and dropped when it is rolled back.
+        self.pending_cache_entries = {}
+        #Functions to be called once the open transaction has committed, dropped when it is rolled back.
+        self.after_commit = []
+        #The last 'PRAGMA data_version' read on this connection, see DbHandler.check_data_version().
+        self.data_version = None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.transaction_depth:
+            return False
+        return super(PooledConnection, self).__exit__(exc_type, exc_value, traceback)
+
+
+class ConnectionPool:
+    """
+    Hands out one sqlite connection per thread for a database.
+    With the default profile the database is in WAL mode, so the readers of all threads run concurrently with a writer.
+    Writes are serialized by a lock inside the process and by 'BEGIN IMMEDIATE' plus the busy timeout between processes.
+    """
+
+    def __init__(self, db_name, profile = constants.DEFAULT_DB_PROFILE, timeout = constants.DB_BUSY_TIMEOUT):
+        """
+        @param db_name: The path of the database.
+        @param profile: The name of the pragma profile in constants.DB_PROFILES set on every connection.
+        @param timeout: The amount of seconds a connection waits for a lock held by another connection.
+        """
+
+        self.db_name = db_name
+        self.pragmas = constants.DB_PROFILES[profile]
+        self.timeout = timeout
+        self.local = threading.local()
+        #Held for the whole duration of a write transaction, reentrant for nested transactions of the same thread.
+        self.write_lock = threading.RLock()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        #In-memory databases exist per connection, so all threads have to share one connection for them.
+        self.shared_connection = None
+
+    def connect(self):
+        connection = sqlite3.connect(self.db_name, timeout = self.timeout, check_same_thread = False,
+                                     factory = PooledConnection)
+        self.apply_pragmas(connection)
+        with self.connections_lock:
+            self.connections.append(connection)
+        return connection
+
+    def apply_pragmas(self, connection):
+        for name, value in self.pragmas:
+            #Pragmas don't accept placeholders, the values only come from constants.DB_PROFILES.
+            connection.execute("PRAGMA {} = {}".format(name, value))
+
+    def get_connection(self):
+        """
+        Returns the connection of the calling thread, which is opened on first use.
+        """
+
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if self.db_name == ":memory:":
+                with self.connections_lock:
+                    if self.shared_connection is None:
+                        self.shared_connection = sqlite3.connect(self.db_name, check_same_thread = False,
+                                                                 factory = PooledConnection)
+                        self.apply_pragmas(self.shared_connection)
+                        self.connections.append(self.shared_connection)
+                connection = self.shared_connection
+            else:
+                connection = self.connect()
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed statements in one write transaction on the connection of the calling thread.
+        The transaction is committed at the end of the block and rolled back if an exception leaves it.
+        Nested blocks become part of the outermost transaction, which commits or rolls back all of them together.
+        The pending lookup cache entries and the after_commit functions of the connection are published and called
+        after the commit, on a rollback they are dropped.
+        """
+
+        connection = self.get_connection()
+        with self.write_lock:
+            if connection.transaction_depth == 0:
+                if connection.in_transaction:
+                    #A transaction opened implicitly by a statement outside of a transaction()-block.
+                    connection.commit()
+                connection.execute("BEGIN IMMEDIATE")
+                connection.transaction_depth += 1
+                try:
+                    yield connection
+                except BaseException:
+                    connection.transaction_depth -= 1
+                    connection.pending_cache_entries = {}
+                    connection.after_commit = []
+                    connection.rollback()
+                    raise
+                connection.transaction_depth -= 1
+                pending = connection.pending_cache_entries
+                connection.pending_cache_entries = {}
+                after_commit = connection.after_commit
+                connection.after_commit = []
+                connection.commit()
+                for cache, entries in pending.items():
+                    for value, key in entries.items():
+                        cache.put(value, key)
+                for function in after_commit:
+                    function()
+            else:
+                #Nested blocks simply join the outer transaction. Savepoints would make every nested block flush the
+                #pending changes of the full text index, which leaves it fragmented into many tiny segments.
+                connection.transaction_depth += 1
+                try:
+                    yield connection
+                finally:
+                    connection.transaction_depth -= 1
+
+    def close_connection(self):
+        """
+        Closes the connection of the calling thread, e.g. at the end of a worker thread.
+        """
+
+        connection = getattr(self.local, "connection", None)
+        if connection is None or connection is self.shared_connection:
+            return
+        del self.local.connection
+        with self.connections_lock:
+            self.connections.remove(connection)
+        connection.commit()
+        connection.close()
+
+    def close_all(self):
+        """
+        Commits and closes the connections of all threads.
+        """
+
+        with self.connections_lock:
+            connections = self.connections[:]
+            del self.connections[:]
+            self.shared_connection = None
+        for connection in connections:
+            try:
+                connection.commit()
+                connection.close()
+            except sqlite3.Error as e:
+                print("Error: "+e.args[0])
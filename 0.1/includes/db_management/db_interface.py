@@ -1,10 +1,14 @@
 import sqlite3
 import os, sys
 import random
+import itertools
+from collections import namedtuple
 
 import constants
 from misc.myExceptions import MissingTableError, InvalidColumnError
-from misc.helper_functions import contains, dict_factory
+from misc.helper_functions import contains, dict_factory, create_placeholders, create_fts_query
+from lookup_cache import LookupCache
+from connection_pool import ConnectionPool
 
 
 class DbHandler:
@@ -12,35 +16,92 @@ class DbHandler:
     This class handles all database-related operations in the program.
     """
 
-    def __init__(self, db_name):
+    def __init__(self, db_name, profile = constants.DEFAULT_DB_PROFILE):
         """
-        Creates a new DbHandler-Object to a new or existing database. A cursor-object is also initiated.
+        Creates a new DbHandler-Object to a new or existing database.
+        Every thread using the handler gets its own connection out of a ConnectionPool.
 
         @param db_name: The name of the database, if an invalid name is given a random number will be generated as name.
+        @param profile: The name of the pragma profile in constants.DB_PROFILES the connections are configured with.
         """
 
         self.db_name = db_name
 
         try:
-            self.db_connection = sqlite3.connect(self.db_name)
+            self.pool = ConnectionPool(self.db_name, profile)
+            self.pool.get_connection()
         except TypeError:
             self.db_name = str(random.randint(99999, 999999)) + ".db"
-            self.db_connection = sqlite3.connect(self.db_name)
+            self.pool = ConnectionPool(self.db_name, profile)
         except sqlite3.Error as e:
             print("Error: "+e.args[0])
 
-        self.cursor = self.db_connection.cursor()
         self.tables = []
+        self.indexes = []
         self.db_information = {}
+        #The primary key columns of every table in key order.
+        self.primary_keys = {}
+        #The INTEGER PRIMARY KEY column of every table, which sqlite uses as alias for the rowid.
+        self.rowid_columns = {}
+        #Name->id caches for lookup tables, keyed by (table_name, key_column, value_column).
+        self.lookup_caches = {}
+        #The schema version the catalog in self.db_information was built from. None means the catalog is stale.
+        self.schema_version = None
         self.update_db_description()
 
+    @property
+    def db_connection(self):
+        """
+        The connection of the calling thread. Connections must not be shared between threads.
+        There is no shared cursor, every method takes its own one with db_connection.cursor(), so concurrent calls
+        never share one.
+        """
+
+        return self.pool.get_connection()
+
+    def transaction(self):
+        """
+        Returns a context manager running the enclosed statements in one write transaction, see
+        ConnectionPool.transaction(). Write transactions of all threads are serialized, reads run concurrently.
+        """
+
+        return self.pool.transaction()
+
+    def batch(self):
+        """
+        Returns a context manager grouping many calls into one write transaction, which is committed (and synced)
+        once at the end of the block:
+
+            with db.batch():
+                for entry in entries:
+                    db.change_entry(entry)
+
+        The transactions of the methods called inside the block join the batch, so they don't commit on their own.
+        If an exception leaves the block, nothing of the batch is written. There are no savepoints: if a failing call
+        is caught inside the block, the changes it made before failing stay part of the batch and are committed.
+        """
+
+        return self.pool.transaction()
+
+    def after_commit(self, function):
+        """
+        Calls function once the write transaction of the calling thread has committed, or right away if none is open.
+        If the transaction is rolled back, function is never called. Used to keep state held in memory in line with
+        the database.
+        """
+
+        connection = self.db_connection
+        if connection.transaction_depth:
+            connection.after_commit.append(function)
+        else:
+            function()
+
     #Table-Management
 
     def __del__(self):
-        self.db_connection.commit()
-        self.db_connection.close()
+        self.pool.close_all()
 
-    def create_table(self, table_name, cols):
+    def create_table(self, table_name, cols, constraints = []):
         """
         Creates a new table with the given columns.
 
@@ -49,46 +110,53 @@ class DbHandler:
 
         @param cols: The columns of the new table.
         Must be a list containing tuples of names and corresponding SQL-types such as ("id", "INTEGER")
+        @param constraints: A list of table constraints such as "PRIMARY KEY (id, name)"
         """
 
+        cursor = self.db_connection.cursor()
         sql = "CREATE TABLE IF NOT EXISTS {} (".format(table_name)
 
         for entry in cols:
             sql += "{} {},".format(entry[0],entry[1])
 
+        for constraint in constraints:
+            sql += "{},".format(constraint)
+
         sql = str(sql.rsplit(",", 1)[0])
         sql += " )"
 
         #print(sql)
 
-        with self.db_connection:
-            self.cursor.execute(sql)
-        self.update_db_description()
+        with self.transaction():
+            cursor.execute(sql)
+        self.invalidate_db_description()
 
-    def alter_table(self, table_name, cols):
+    def alter_table(self, table_name, cols, constraints = []):
         """
         Takes an existing table and alters its columns.
         NOTE: Pre-Existing Columns not included in cols will be deleted!
 
         @param table_name: A string containing the name of the table to be altered.
         @param cols: A list of tuples containing the columns for the new table.
+        @param constraints: A list of table constraints for the new table.
         """
 
+        cursor = self.db_connection.cursor()
         self.update_db_description()
         temp_table_name = table_name+"_temp"
         try:
             if table_name in self.db_information:
                 sql_alter_temp_statement = "ALTER TABLE {} RENAME TO {}".format(table_name,temp_table_name)
-                with self.db_connection:
-                    self.cursor.execute(sql_alter_temp_statement)
-                self.update_db_description()
+                with self.transaction():
+                    cursor.execute(sql_alter_temp_statement)
+                self.invalidate_db_description()
             else:
                 raise MissingTableError(table_name, self.db_name)
         except MissingTableError as e:
             print(e.message)
             sys.exit(0)
 
-        self.create_table(table_name, cols)
+        self.create_table(table_name, cols, constraints)
         print(self.db_information)
 
         old_columns = self.fetch_table_description(temp_table_name)
@@ -98,7 +166,6 @@ class DbHandler:
 
         self.copy_data_into_table(temp_table_name, table_name, columns_to_copy)
         self.drop_table(temp_table_name)
-        self.update_db_description()
 
     def copy_data_into_table(self, source_table, target_table, columns):
         """
@@ -109,6 +176,7 @@ class DbHandler:
         @param columns: List of the column names to be copied.
         @return:
         """
+        cursor = self.db_connection.cursor()
         cols_source = self.fetch_table_description(source_table)
         cols_target = self.fetch_table_description(target_table)
         sql_cols = ", ".join(columns)
@@ -119,9 +187,9 @@ class DbHandler:
                     target_table, sql_cols, sql_cols, source_table
                 )
 
-                with self.db_connection:
+                with self.transaction():
                     #rint(sql)
-                    self.cursor.execute(sql)
+                    cursor.execute(sql)
             else:
                 table_names = "{}, {}".format(source_table, target_table)
                 columns = [self.fetch_table_description(source_table), self.fetch_table_description(target_table)]
@@ -130,6 +198,23 @@ class DbHandler:
             print(e.message)
             print(e.detail_info)
 
+    def create_index(self, index_name, table_name, columns, unique = False):
+        """
+        Creates a new index on a table, if no index with the same name exists.
+
+        @param index_name: Name of the new index.
+        @param table_name: Name of the indexed table.
+        @param columns: A list of the indexed columns. Expressions such as "IFNULL(year, '')" are allowed as well.
+        @param unique: If this is true, the index enforces that no two rows share the same indexed values.
+        """
+
+        cursor = self.db_connection.cursor()
+        sql = "CREATE {}INDEX IF NOT EXISTS {} ON {} ({})".format("UNIQUE " if unique else "", index_name,
+                                                                  table_name, ", ".join(columns))
+        with self.transaction():
+            cursor.execute(sql)
+        self.invalidate_db_description()
+
     def drop_table(self, table_name):
         """
         This function checks if a table exists in the database and drops it.
@@ -137,11 +222,13 @@ class DbHandler:
         @param table_name: A String containing the name of the table to be dropped.
         """
 
+        cursor = self.db_connection.cursor()
         sql = "DROP TABLE IF EXISTS {}".format(table_name)
-        with self.db_connection:
-            self.cursor.execute(sql)
+        with self.transaction():
+            cursor.execute(sql)
             print("Table {} dropped!".format(table_name))
-        self.update_db_description()
+        self.invalidate_db_description()
+        self.clear_lookup_caches(table_name)
 
     #Data-Management
 
@@ -151,38 +238,90 @@ class DbHandler:
 
         @param table_name: A string containing the name of the target table.
         @param values: One or several dictionaries containing column names and corresponding values.
+        @return: The rowid of the last inserted row.
         """
 
-        table_columns = self.db_information[table_name]
-        for entry in values:
-
-            sql = "INSERT INTO {} (".format(table_name)
-            temp_values = {}
+        rowids = self.insert_many_into_table(table_name, values)
+        if rowids:
+            return rowids[-1]
+        return None
 
-            for col in entry:
-                if col in table_columns:
-                    temp_values[col] = entry[col]
+    def insert_many_into_table(self, table_name, rows, batch_size = 500):
+        """
+        Inserts any number of rows into a table inside a single transaction.
+        The rows are grouped by their set of columns and every group is written with one parameterized executemany.
 
-            #Because dicts aren't in order this list is used to ensure the right values get entered
-            #into the correct columns.
-            ordered_keys = []
-            for key in temp_values.keys():
-                ordered_keys.append(key)
-                sql += str(key)+","
+        @param table_name: A string containing the name of the target table.
+        @param rows: An iterable of dictionaries containing column names and corresponding values.
+        Generators are consumed in batches of batch_size, so the input never has to be held in memory as a whole.
+        Keys which aren't columns of the table are ignored, rows without any valid key are skipped.
+        @param batch_size: The amount of rows read from 'rows' before they are written into the database.
+        @return: A list containing the rowids of all the new rows in input order.
+        """
 
-            sql = str(sql.rsplit(",", 1)[0]) + ") VALUES ("
+        self.update_db_description()
+        try:
+            if table_name not in self.db_information:
+                raise MissingTableError(table_name, self.db_name)
+        except MissingTableError as e:
+            print(e.message)
+            return []
 
-            for key in ordered_keys:
-                sql += "'"+str(entry[key]) + "',"
+        rows = iter(rows)
+        rowids = []
+        lookup_caches = self.get_table_lookup_caches(table_name)
+        self._insert_batches(table_name, rows, batch_size, rowids, lookup_caches)
+        return rowids
 
-            sql = str(sql.rsplit(",", 1)[0]) + ")"
-            #print(sql)
+    def _insert_batches(self, table_name, rows, batch_size, rowids, lookup_caches):
+        """
+        Writes the rows for insert_many_into_table() in a single transaction and collects the new rowids.
+        """
 
-            if ordered_keys:
-                with self.db_connection:
-                    #print(sql)
-                    self.cursor.execute(sql)
-        return self.cursor.lastrowid
+        cursor = self.db_connection.cursor()
+        table_columns = self.db_information[table_name]
+        rowid_column = self.rowid_columns.get(table_name)
+
+        with self.transaction():
+            batch = list(itertools.islice(rows, batch_size))
+            while batch:
+                #The column order of the table is used as key, so dicts with the same keys in different order
+                #end up in the same group.
+                groups = {}
+                for position, entry in enumerate(batch):
+                    group_cols = tuple(col for col in table_columns if col in entry)
+                    if group_cols:
+                        groups.setdefault(group_cols, []).append((position, entry))
+
+                batch_rowids = [None] * len(batch)
+                for group_cols, group in groups.items():
+                    sql = "INSERT INTO {} ({}) VALUES {}".format(table_name, ", ".join(group_cols),
+                                                                  create_placeholders(len(group_cols)))
+                    parameters = [tuple(entry[col] for col in group_cols) for position, entry in group]
+
+                    if rowid_column in group_cols:
+                        #Explicit rowids can't be derived from last_insert_rowid(), so these rows are inserted
+                        #one by one. They still share the surrounding transaction.
+                        for (position, entry), values in zip(group, parameters):
+                            cursor.execute(sql, values)
+                            batch_rowids[position] = cursor.lastrowid
+                    else:
+                        #Without explicit rowids sqlite assigns consecutive ids to the rows of one executemany
+                        #inside a transaction, so the ids can be reconstructed from the last one.
+                        cursor.executemany(sql, parameters)
+                        cursor.execute("SELECT last_insert_rowid()")
+                        last_rowid = cursor.fetchone()[0]
+                        first_rowid = last_rowid - len(group) + 1
+                        for offset, (position, entry) in enumerate(group):
+                            batch_rowids[position] = first_rowid + offset
+
+                for cache in lookup_caches:
+                    for entry, rowid in zip(batch, batch_rowids):
+                        if rowid is not None and cache.value_column in entry:
+                            self.cache_lookup_key(cache, entry[cache.value_column], rowid)
+
+                rowids.extend(rowid for rowid in batch_rowids if rowid is not None)
+                batch = list(itertools.islice(rows, batch_size))
 
     def delete_from_table(self, table_name, col, value):
         """
@@ -193,12 +332,21 @@ class DbHandler:
         @value: The value the WHERE-clause checks against.
         """
 
+        cursor = self.db_connection.cursor()
         self.update_db_description()
         try:
             if table_name in self.db_information:
                 sql = "DELETE FROM {} WHERE {} = ?".format(table_name, col)
-                with self.db_connection:
-                    self.cursor.execute(sql, (value,))
+                with self.transaction():
+                    cursor.execute(sql, (value,))
+                self.discard_pending_cache_entries(table_name)
+                for cache in self.get_table_lookup_caches(table_name):
+                    if col == cache.value_column:
+                        cache.discard_value(value)
+                    elif col == cache.key_column:
+                        cache.discard_key(value)
+                    else:
+                        cache.clear()
             else:
                 raise MissingTableError(table_name, self.db_name)
         except MissingTableError as e:
@@ -214,6 +362,7 @@ class DbHandler:
 
         """
 
+        cursor = self.db_connection.cursor()
         sql = "UPDATE {} SET ".format(table_name)
         sql_condition = "WHERE "
         sql_values = ""
@@ -233,64 +382,153 @@ class DbHandler:
         #print(sql)
         #print(sql_parameters)
 
-        with self.db_connection:
+        with self.transaction():
             print(sql, sql_parameters)
             #print(tuple(sql_parameters))
-            self.cursor.execute(sql,tuple(sql_parameters))
-
-        self.update_db_description()
+            cursor.execute(sql,tuple(sql_parameters))
+        self.discard_pending_cache_entries(table_name)
+        for cache in self.get_table_lookup_caches(table_name):
+            cache.clear()
 
 
     #Database-Information
 
     def fetch_table_list(self):
         """
-        Updates the list of existing tables inside the database.
+        Updates the lists of existing tables and indexes inside the database.
         """
 
+        cursor = self.db_connection.cursor()
         with self.db_connection:
-            self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
-            del self.tables[:]
-            for table_name in self.cursor.fetchall():
-                self.tables.append(table_name[0])
+            #The lists are replaced instead of changed in place, so other threads never see them half-filled.
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+            self.tables = [table_name[0] for table_name in cursor.fetchall()]
+
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index';")
+            self.indexes = [index_name[0] for index_name in cursor.fetchall()]
 
     def fetch_table_description(self, table_name):
         """
         Fetches a list of all columns in one table.
+        The columns are taken from the schema catalog, which is only rebuilt when the schema has changed.
 
         @param table_name: Name of the corresponding table.
         @return: A list containing the names of all the columns in the table.
         """
 
-        with self.db_connection:
-            column_list = []
-            try:
-                #String formatting is necessary because sqlite doesn't accept placeholders for table names!
-                #This if-statement serves as alternative protection against sql-injection.
-                #self.fetch_table_list()
-                if table_name in self.tables:
-                    with self.db_connection:
-                        self.cursor.execute("SELECT * FROM {}".format(table_name))
-                        for col in self.cursor.description:
-                            column_list.append(col[0])
-                else:
-                    raise MissingTableError(table_name, self.db_name)
-            except MissingTableError as e:
-                print(e.message)
+        self.update_db_description()
+        column_list = []
+        try:
+            if table_name in self.db_information:
+                column_list = self.db_information[table_name][:]
+            else:
+                raise MissingTableError(table_name, self.db_name)
+        except MissingTableError as e:
+            print(e.message)
         return column_list
 
-    def update_db_description(self):
+    def read_table_info(self, table_name):
+        """
+        Reads the columns of one table directly from the database via 'PRAGMA table_info'.
+        Unlike a 'SELECT *' this only touches the schema and not the data of the table.
+
+        @param table_name: Name of the corresponding table. Must be contained in self.tables.
+        @return: A tuple containing a list of all the column names, a list of the primary key columns in key order
+        and the name of the column which is an alias for the rowid (None if there is none).
+        """
+
+        cursor = self.db_connection.cursor()
+        #String formatting is necessary because sqlite doesn't accept placeholders for table names!
+        #Only names out of sqlite_master are passed to this function, which protects against sql-injection.
+        cursor.execute("PRAGMA table_info(\"{}\")".format(table_name))
+        table_info = cursor.fetchall()
+
+        columns = [col[1] for col in table_info]
+        primary_keys = sorted([col for col in table_info if col[5]], key = lambda col: col[5])
+        rowid_column = None
+        if len(primary_keys) == 1 and primary_keys[0][2].upper() == "INTEGER":
+            rowid_column = primary_keys[0][1]
+        return columns, [col[1] for col in primary_keys], rowid_column
+
+    def read_schema_version(self):
+        """
+        Returns the schema version of the database. Sqlite increments it on every schema change,
+        including changes made by other connections or processes.
+        """
+
+        cursor = self.db_connection.cursor()
+        cursor.execute("PRAGMA schema_version")
+        return cursor.fetchone()[0]
+
+    def check_data_version(self):
+        """
+        Empties the lookup caches if another connection has committed changes since the last check on the connection
+        of the calling thread. Sqlite changes the data version of a connection on every commit of any other connection,
+        so writes of other handlers and processes (and of other threads of this handler) are noticed as well.
+        """
+
+        connection = self.db_connection
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA data_version")
+        data_version = cursor.fetchone()[0]
+        if connection.data_version is not None and data_version != connection.data_version:
+            #The caches are emptied instead of dropped, so the pending entries of an open transaction stay valid.
+            for cache in list(self.lookup_caches.values()):
+                cache.clear()
+        connection.data_version = data_version
+
+    def invalidate_db_description(self):
+        """
+        Marks the schema catalog as stale, so it gets rebuilt on the next access.
+        Has to be called after every DDL-statement executed by this handler.
+        """
+
+        self.schema_version = None
+
+    def update_db_description(self, force = False):
         """
         Updates self.db_information, a dictionary containing all tables in the database and its columns.
+        The catalog is only rebuilt if it was invalidated or the schema version of the database has changed.
+
+        @param force: If this is true, the catalog is rebuilt regardless of the schema version.
         """
 
+        schema_version = self.read_schema_version()
+        if not force and self.schema_version is not None and schema_version == self.schema_version:
+            return
+
         self.fetch_table_list()
+        #Built aside and swapped in at once, so other threads keep reading a complete catalog meanwhile.
+        db_information = {}
+        primary_keys = {}
+        rowid_columns = {}
         for table in self.tables:
-            self.db_information[table] = self.fetch_table_description(table)
+            db_information[table], primary_keys[table], rowid_columns[table] = self.read_table_info(table)
+        self.db_information = db_information
+        self.primary_keys = primary_keys
+        self.rowid_columns = rowid_columns
+        self.schema_version = schema_version
+
+    def explain_query_plan(self, sql, parameters = None):
+        """
+        Returns the query plan sqlite chooses for a statement, without executing it.
+
+        @param sql: The statement to be explained.
+        @param parameters: The values for the placeholders in sql. If none are given, NULL is bound to every placeholder.
+        @return: A list containing the detail-strings of all the steps of the plan, e.g. "SEARCH tracks USING ..."
+        """
+
+        cursor = self.db_connection.cursor()
+        if parameters is None:
+            parameters = (None,) * sql.count("?")
+        with self.db_connection:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+            return [step[3] for step in cursor.fetchall()]
 
     #Output
 
-    def fetch_table(self, table_name, columns = [], condition = [], condition_operator = "AND", dict_output = False):
+    def fetch_table(self, table_name, columns = [], condition = [], condition_operator = "AND", dict_output = False,
+                    order_by = None, descending = False, limit = None, offset = 0):
         """
         Returns a list of dictionaries containing the rows of the list which fulfill the condition.
         Per default it outputs all the columns as list.
@@ -300,13 +538,18 @@ class DbHandler:
         @param condition: A list of tuples containing (column+condition)-value pairs for a WHERE-clause
         @param condition_operator: A standard logic operator to connect conditions.
         @param dict_output: If this is true, the function will return a dictionary instead of a list.
+        @param order_by: A column of the table to sort the rows by. Ties are sorted by rowid.
+        @param descending: If this is true, the rows are sorted in descending order.
+        @param limit: The maximal amount of rows returned, used together with offset to fetch a window of the table.
+        @param offset: The amount of rows skipped before the first returned row.
         @return: Either a list of a dictionary containing the data from the table.
         """
 
+        cursor = self.db_connection.cursor()
         self.update_db_description()
         try:
             if table_name in self.db_information:
-                table_cols = self.fetch_table_description(table_name)
+                table_cols = self.db_information[table_name]
                 if columns:
                     if contains(columns, table_cols):
                         columns = ", ".join(columns)
@@ -316,34 +559,28 @@ class DbHandler:
                 else:
                     sql = "SELECT * "
                 sql += "FROM {} ".format(table_name)
-                if condition:
-                    sql_condition_placeholder = "WHERE "
-                    values = []
-                    for con in condition:
-                        sql_condition_placeholder += "{} ? {} ".format(con[0], condition_operator)
-                        values.append(con[1])
-
-                    sql += sql_condition_placeholder.rsplit(condition_operator, 1)[0]
-                    with self.db_connection:
-                        if dict_output:
-                            self.db_connection.row_factory = dict_factory
-                            temp_cursor = self.db_connection.cursor()
-                            temp_cursor.execute(sql, values)
-                            data = temp_cursor.fetchall()
-                        else:
-                            self.cursor.execute(sql, values)
-                            data = self.cursor.fetchall()
-                            #print(sql)
-                else:
-                    with self.db_connection:
-                        if dict_output:
-                            self.db_connection.row_factory = dict_factory
-                            temp_cursor = self.db_connection.cursor()
-                            temp_cursor.execute(sql)
-                            data = temp_cursor.fetchall()
-                        else:
-                            self.cursor.execute(sql)
-                            data = self.cursor.fetchall()
+
+                sql_condition, values = self.create_condition(condition, condition_operator)
+                sql += sql_condition
+
+                if order_by:
+                    if order_by not in table_cols:
+                        raise InvalidColumnError(table_name, order_by, [table_cols])
+                    direction = "DESC" if descending else "ASC"
+                    sql += " ORDER BY {0} {1}, rowid {1}".format(order_by, direction)
+                elif limit is not None:
+                    #Windows are only stable if the order is.
+                    sql += " ORDER BY rowid"
+                if limit is not None:
+                    sql += " LIMIT ? OFFSET ?"
+                    values.extend((limit, offset))
+
+                with self.db_connection:
+                    if dict_output:
+                        #Only set on this cursor, other users of the connection still get tuples.
+                        cursor.row_factory = dict_factory
+                    cursor.execute(sql, values)
+                    data = cursor.fetchall()
 
                 return data
             else:
@@ -354,14 +591,51 @@ class DbHandler:
             print(e.message)
             print(e.detail_info)
 
+    def count_rows(self, table_name, condition = [], condition_operator = "AND"):
+        """
+        Returns the amount of rows in a table which fulfill the condition. See fetch_table() for the parameters.
+        """
+
+        cursor = self.db_connection.cursor()
+        self.update_db_description()
+        try:
+            if table_name in self.db_information:
+                sql_condition, values = self.create_condition(condition, condition_operator)
+                with self.db_connection:
+                    cursor.execute("SELECT COUNT(*) FROM {} {}".format(table_name, sql_condition), values)
+                    return cursor.fetchone()[0]
+            else:
+                raise MissingTableError(table_name, self.db_name)
+        except MissingTableError as e:
+            print(e.message)
+        return 0
+
+    def create_condition(self, condition, condition_operator = "AND"):
+        """
+        Builds a WHERE-clause out of a list of (column+condition)-value pairs such as [("id >", 2), ("id <", 5)].
+
+        @return: A tuple containing the clause (empty if there is no condition) and a list of the values for it.
+        """
+
+        if not condition:
+            return "", []
+
+        sql_condition_placeholder = "WHERE "
+        values = []
+        for con in condition:
+            sql_condition_placeholder += "{} ? {} ".format(con[0], condition_operator)
+            values.append(con[1])
+        return sql_condition_placeholder.rsplit(condition_operator, 1)[0], values
 
     def output_table(self, table_name):
         """
-        Prints the table into the command line.
+        Prints the table into the command line. See db_management/exporter.py to export the tracks into files.
 
         @param table_name:
         """
 
+        cursor = self.db_connection.cursor()
+        self.update_db_description()
         try:
             if table_name in self.db_information:
                 print(table_name.upper())
@@ -373,8 +647,9 @@ class DbHandler:
 
                 with self.db_connection:
                     #print(sql)
-                    self.cursor.execute(sql)
-                    for row in self.cursor.fetchall():
+                    cursor.execute(sql)
+                    #Iterating the cursor steps through the table, so it is never held in memory as a whole.
+                    for row in cursor:
                         for col in row:
                             print (col,"|", end="\t")
                         print ("\n")
@@ -387,19 +662,152 @@ class DbHandler:
     def get_foreign_key_value(self, table_name, key_column, value_column, value):
         """
         Returns the foreign key corresponding to value in value_column in table_name.
+        If value doesn't exist yet, a new row is inserted.
         """
 
-        sql = "SELECT {} FROM {} WHERE {} = ?".format(key_column, table_name, value_column)
+        cursor = self.db_connection.cursor()
+        cache = self.get_lookup_cache(table_name, key_column, value_column)
+        key = self.get_cached_key(cache, value)
+        if key is not None:
+            return key
+
+        sql = "SELECT {} FROM {} WHERE {} = ? ORDER BY {} LIMIT 1".format(key_column, table_name, value_column,
+                                                                         key_column)
         value_tup = (value,)
-        with self.db_connection:
-            self.cursor.execute(sql, value_tup)
-            result = self.cursor.fetchone()
-        if result:
-            return result[0]
-        else:
-            result = self.insert_into_table(table_name, {value_column:value})
+        #The lookup and the insert share one write transaction, so no other thread inserts the name in between.
+        with self.transaction():
+            cursor.execute(sql, value_tup)
+            result = cursor.fetchone()
+            if result:
+                self.cache_lookup_key(cache, value, result[0])
+                return result[0]
+            else:
+                result = self.insert_into_table(table_name, {value_column:value})
+                return result
+
+    def get_foreign_key_values(self, table_name, key_column, value_column, values, chunk_size = 500):
+        """
+        Batched version of get_foreign_key_value().
+        Names which aren't cached are looked up with one 'IN (...)'-query per chunk_size names,
+        the remaining missing names are inserted in a single transaction.
+
+        @param values: An iterable of names. Duplicates and None are ignored.
+        @return: A dictionary containing the names and their corresponding foreign keys.
+        """
+
+        cursor = self.db_connection.cursor()
+        cache = self.get_lookup_cache(table_name, key_column, value_column)
+        result = {}
+        missing = []
+        for value in values:
+            if value is None or value in result:
+                continue
+            key = self.get_cached_key(cache, value)
+            result[value] = key
+            if key is None:
+                missing.append(value)
+
+        if not missing:
             return result
 
+        #The lookups and the inserts share one write transaction, so no other thread inserts the names in between.
+        with self.transaction():
+            for start in range(0, len(missing), chunk_size):
+                chunk = missing[start:start+chunk_size]
+                #The names are joined as bound values instead of being read back from the table: the column
+                #stores e.g. the number 311 as the text '311', which wouldn't match the name the caller passed.
+                sql = "SELECT {0}, names.column1 FROM (VALUES {3}) AS names JOIN {2} ON {2}.{1} = names.column1 " \
+                      "ORDER BY {0}".format(key_column, value_column, table_name, ", ".join(["(?)"] * len(chunk)))
+                cursor.execute(sql, chunk)
+                for key, value in cursor.fetchall():
+                    if result[value] is None:
+                        result[value] = key
+                        self.cache_lookup_key(cache, value, key)
+
+            missing = [value for value in missing if result[value] is None]
+            new_keys = self.insert_many_into_table(table_name, ({value_column: value} for value in missing))
+        result.update(zip(missing, new_keys))
+        return result
+
+    #Lookup-Caches
+
+    def get_lookup_cache(self, table_name, key_column, value_column):
+        """
+        Returns the name->id cache of a lookup table. A new cache is pre-warmed with the first
+        constants.LOOKUP_CACHE_SIZE rows of the table in a single query.
+        The caches are emptied first if the database was changed by another connection, see check_data_version().
+        """
+
+        cursor = self.db_connection.cursor()
+        self.check_data_version()
+        cache_key = (table_name, key_column, value_column)
+        #A cache created by two threads at once is harmless, both are filled from the same table.
+        if cache_key not in self.lookup_caches:
+            cache = LookupCache(table_name, key_column, value_column, constants.LOOKUP_CACHE_SIZE)
+            sql = "SELECT {0}, {1} FROM {2} ORDER BY {0} LIMIT ?".format(key_column, value_column, table_name)
+            try:
+                with self.db_connection:
+                    cursor.execute(sql, (cache.max_size,))
+                    for key, value in cursor.fetchall():
+                        self.cache_lookup_key(cache, value, key)
+            except sqlite3.OperationalError as e:
+                print(e.args[0])
+            self.lookup_caches[cache_key] = cache
+        return self.lookup_caches[cache_key]
+
+    def get_table_lookup_caches(self, table_name):
+        """
+        Returns a list of all the lookup caches belonging to table_name.
+        """
+
+        #Other threads may add caches meanwhile, so a copy is iterated.
+        return [cache for cache in list(self.lookup_caches.values()) if cache.table_name == table_name]
+
+    def clear_lookup_caches(self, table_name = None):
+        """
+        Removes the lookup caches of one table or, if no table is given, all of them.
+        """
+
+        self.discard_pending_cache_entries(table_name)
+        for cache_key in list(self.lookup_caches):
+            if table_name is None or cache_key[0] == table_name:
+                self.lookup_caches.pop(cache_key, None)
+
+    def get_cached_key(self, cache, value):
+        """
+        Returns the cached id of value or None. Ids of names inserted by the open transaction of the calling thread
+        aren't in the cache yet, they are taken from the pending entries of its connection.
+        """
+
+        key = cache.get(value)
+        if key is None:
+            pending = self.db_connection.pending_cache_entries.get(cache)
+            if pending:
+                key = pending.get(value)
+        return key
+
+    def cache_lookup_key(self, cache, value, key):
+        """
+        Stores the id of value in the cache. Inside a transaction the entry stays pending on the connection until the
+        transaction commits, so other threads never get the id of a row which may still be rolled back.
+        """
+
+        connection = self.db_connection
+        if connection.transaction_depth:
+            connection.pending_cache_entries.setdefault(cache, {}).setdefault(value, key)
+        else:
+            cache.put(value, key)
+
+    def discard_pending_cache_entries(self, table_name = None):
+        """
+        Drops the pending lookup cache entries of one table or of all tables written by the calling thread.
+        """
+
+        pending = self.db_connection.pending_cache_entries
+        for cache in list(pending):
+            if table_name is None or cache.table_name == table_name:
+                del pending[cache]
+
 
 class TrackDbHandler(DbHandler):
     """
@@ -407,8 +815,8 @@ class TrackDbHandler(DbHandler):
     which can be found in DbHandler.
     """
 
-    def __init__(self, db_name, initialize = True):
-        super(TrackDbHandler, self).__init__(db_name)
+    def __init__(self, db_name, initialize = True, profile = constants.DEFAULT_DB_PROFILE):
+        super(TrackDbHandler, self).__init__(db_name, profile)
 
         self.foreign_keys = constants.FOREIGN_KEYS
         self.entry_columns = constants.ENTRY_COLS_SORTED
@@ -420,12 +828,17 @@ class TrackDbHandler(DbHandler):
             self.create_table("genres", constants.GENRES_COLS)
             self.create_table("collections", constants.COLLECTIONS_COLS)
             self.create_table("tracks", constants.TRACKS_COLS)
-            self.create_table("collections_tracks", constants.COLLECTIONS_TRACKS_COLS)
+            self.create_table("collections_tracks", constants.COLLECTIONS_TRACKS_COLS,
+                              constants.COLLECTIONS_TRACKS_CONSTRAINTS)
+            self.create_natural_key_index()
+            self.create_indexes()
+            self.create_search_index()
 
     def get_entries(self, con_table = None, con_col = None, con_value = None):
         """
         Fetches a list of entries which fulfill the provided condition.
         """
+        cursor = self.db_connection.cursor()
         cols = ", ".join(self.entry_columns)
         sql =   "SELECT {} FROM {}".format(cols, constants.JOIN_COLS)
 
@@ -434,73 +847,417 @@ class TrackDbHandler(DbHandler):
             with self.db_connection:
                 print(sql)
                 print(con_value)
-                self.cursor.execute(sql, (con_value,))
-                data = self.cursor.fetchall()
+                cursor.execute(sql, (con_value,))
+                data = cursor.fetchall()
         else:
             with self.db_connection:
-                self.cursor.execute(sql)
-                data = self.cursor.fetchall()
+                cursor.execute(sql)
+                data = cursor.fetchall()
         entry_list = []
         for line in data:
             entry_list.append(Entry(line))
         return entry_list
 
 
+    def iter_entry_pages(self, sort_column = "tracks.track_name", page_size = 500, descending = False,
+                         con_table = None, con_col = None, con_value = None):
+        """
+        Streams the entries page by page instead of fetching the whole join at once.
+        Keyset pagination on (sort_column, track_id) is used: every page is a fresh query starting after the last row
+        of the previous page with the row value comparison '(sort_column, track_id) > (?, ?)', so no OFFSET rows are
+        skipped. The rows with NULL in sort_column are paged separately, as NULLs can't be compared.
+        Only sort columns of 'tracks' with an index (tracks.track_id, tracks.track_name, tracks.media_location and
+        tracks.sheet_location, see constants.INDEXES) are streamed from the index, so every page only reads its own
+        rows. The names of interpreters, composers and genres live in the joined tables, so for them and for unindexed
+        columns sqlite sorts the remaining part of the join again for every page.
+
+        @param sort_column: The column to sort by, must be one of constants.ENTRY_COLS_SORTED.
+        @param page_size: The amount of entries per page.
+        @param descending: If this is true, the entries are sorted in descending order.
+        @param con_table, con_col, con_value: An optional condition as in get_entries().
+        @return: A generator yielding lists of up to page_size entries. NULLs come first in ascending order.
+        """
+
+        cursor = self.db_connection.cursor()
+        try:
+            if sort_column not in self.entry_columns:
+                raise InvalidColumnError(constants.JOIN_COLS, sort_column, [self.entry_columns])
+        except InvalidColumnError as e:
+            print(e.message)
+            print(e.detail_info)
+            return
+
+        sql = "SELECT {} FROM {} WHERE ".format(", ".join(self.entry_columns), constants.JOIN_COLS)
+        condition_parameters = []
+        if con_table and con_col and con_value:
+            sql += "{}.{} = ? AND ".format(con_table, con_col)
+            condition_parameters.append(con_value)
+
+        direction, comparison = ("DESC", "<") if descending else ("ASC", ">")
+        order = " ORDER BY {0} {1}, tracks.track_id {1} LIMIT ?".format(sort_column, direction)
+        #Every phase is a tuple (predicate of the first page, predicate of the following pages).
+        #Sqlite sorts NULL before every other value, so the NULLs are the first rows ascending and the last descending.
+        null_phase = ("{} IS NULL".format(sort_column),
+                      "{} IS NULL AND tracks.track_id {} ?".format(sort_column, comparison))
+        value_phase = ("{} IS NOT NULL".format(sort_column),
+                       "({}, tracks.track_id) {} (?, ?)".format(sort_column, comparison))
+        phases = [value_phase, null_phase] if descending else [null_phase, value_phase]
+
+        sort_position = self.entry_columns.index(sort_column)
+        for first_keyset, next_keyset in phases:
+            keyset = first_keyset
+            keyset_parameters = []
+            while True:
+                with self.db_connection:
+                    cursor.execute(sql + keyset + order, condition_parameters + keyset_parameters + [page_size])
+                    data = cursor.fetchall()
+                if data:
+                    yield [Entry(line) for line in data]
+                if len(data) < page_size:
+                    break
+                keyset = next_keyset
+                last_key, last_id = data[-1][sort_position], data[-1][0]
+                if last_key is None:
+                    keyset_parameters = [last_id]
+                else:
+                    keyset_parameters = [last_key, last_id]
+
+    def iter_entries(self, sort_column = "tracks.track_name", page_size = 500, descending = False,
+                     con_table = None, con_col = None, con_value = None):
+        """
+        Streams the entries one by one. See iter_entry_pages() for the parameters.
+        """
+
+        for page in self.iter_entry_pages(sort_column, page_size, descending, con_table, con_col, con_value):
+            for entry in page:
+                yield entry
+
+    def search(self, query, limit = 50, offset = 0):
+        """
+        Searches track, year, interpreter, composer and genre names via the full-text index 'tracks_search'.
+        Every word of the query has to match the beginning of a word in one of these columns, so 'villa lob'
+        finds 'Heitor Villa-Lobos'. Case and diacritics are ignored.
+
+        @param query: The text the user typed.
+        @param limit: The maximal amount of entries returned.
+        @param offset: The amount of best matches to skip, used for paging through the results.
+        @return: A list of entries, the best match first.
+        """
+
+        cursor = self.db_connection.cursor()
+        fts_query = create_fts_query(query)
+        if not fts_query:
+            return []
+
+        #The matches are ranked and limited inside the index first, so only one page of rows is joined.
+        sql = """
+              SELECT {} FROM {} JOIN
+                  (SELECT rowid AS match_id, rank AS match_rank FROM tracks_search
+                   WHERE tracks_search MATCH ? ORDER BY rank LIMIT ? OFFSET ?) AS matches
+                  ON tracks.track_id = matches.match_id
+              ORDER BY matches.match_rank
+              """.format(", ".join(self.entry_columns), constants.JOIN_COLS)
+        with self.db_connection:
+            cursor.execute(sql, (fts_query, limit, offset))
+            data = cursor.fetchall()
+        return [Entry(line) for line in data]
+
+    def create_search_index(self):
+        """
+        Creates the FTS5-table 'tracks_search' over constants.SEARCH_COLS and the triggers keeping it in sync with
+        'tracks' and the lookup tables. A newly created index is filled with the existing tracks.
+        """
+
+        cursor = self.db_connection.cursor()
+        self.update_db_description()
+        search_cols = [col[0] for col in constants.SEARCH_COLS]
+        is_new = "tracks_search" not in self.tables
+
+        insert_sql = """
+                     INSERT INTO tracks_search (rowid, {}) SELECT tracks.track_id, {} FROM {}
+                     """.format(", ".join(search_cols), ", ".join(col[1] for col in constants.SEARCH_COLS),
+                                constants.JOIN_COLS)
+
+        with self.transaction():
+            cursor.execute("""
+                                CREATE VIRTUAL TABLE IF NOT EXISTS tracks_search USING fts5(
+                                    {}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')
+                                """.format(", ".join(search_cols)))
+
+            cursor.execute("""
+                                CREATE TRIGGER IF NOT EXISTS tracks_search_insert AFTER INSERT ON tracks BEGIN
+                                    {} WHERE tracks.track_id = new.track_id;
+                                END
+                                """.format(insert_sql))
+            cursor.execute("""
+                                CREATE TRIGGER IF NOT EXISTS tracks_search_update
+                                AFTER UPDATE OF track_id, {} ON tracks BEGIN
+                                    DELETE FROM tracks_search WHERE rowid = old.track_id;
+                                    {} WHERE tracks.track_id = new.track_id;
+                                END
+                                """.format(", ".join(constants.TRACKS_NATURAL_KEY), insert_sql))
+            cursor.execute("""
+                                CREATE TRIGGER IF NOT EXISTS tracks_search_delete AFTER DELETE ON tracks BEGIN
+                                    DELETE FROM tracks_search WHERE rowid = old.track_id;
+                                END
+                                """)
+
+            for key_column, value_column in self.foreign_keys.items():
+                table_name = constants.FOREIGN_KEY_TABLES[key_column]
+                cursor.execute("""
+                                    CREATE TRIGGER IF NOT EXISTS {0}_search_update AFTER UPDATE OF {2} ON {0} BEGIN
+                                        UPDATE tracks_search SET {2} = new.{2}
+                                        WHERE rowid IN (SELECT track_id FROM tracks WHERE {1} = new.{1});
+                                    END
+                                    """.format(table_name, key_column, value_column))
+                cursor.execute("""
+                                    CREATE TRIGGER IF NOT EXISTS {0}_search_delete AFTER DELETE ON {0} BEGIN
+                                        UPDATE tracks_search SET {2} = NULL
+                                        WHERE rowid IN (SELECT track_id FROM tracks WHERE {1} = old.{1});
+                                    END
+                                    """.format(table_name, key_column, value_column))
+
+            if is_new:
+                cursor.execute(insert_sql)
+        self.invalidate_db_description()
+
+    def rebuild_search_index(self):
+        """
+        Refills 'tracks_search' from scratch, e.g. after the tables were changed with the triggers missing.
+        """
+
+        cursor = self.db_connection.cursor()
+        with self.transaction():
+            cursor.execute("DELETE FROM tracks_search")
+            cursor.execute("""
+                                INSERT INTO tracks_search (rowid, {}) SELECT tracks.track_id, {} FROM {}
+                                """.format(", ".join(col[0] for col in constants.SEARCH_COLS),
+                                           ", ".join(col[1] for col in constants.SEARCH_COLS), constants.JOIN_COLS))
+
+    def create_natural_key_index(self):
+        """
+        Creates the unique index 'tracks_natural_key' over constants.TRACKS_NATURAL_KEY.
+        NULL never equals NULL in a unique index, so NULLs are mapped onto an empty blob, which can't collide with any
+        text or number. Existing duplicates are merged beforehand, otherwise the index couldn't be created.
+        Duplicates with conflicting locations have to be resolved by hand, until then the index isn't created.
+        """
+
+        self.update_db_description()
+        if "tracks_natural_key" in self.indexes:
+            return
+
+        if self.merge_duplicate_tracks():
+            print("The index 'tracks_natural_key' is created once the duplicates above are resolved.")
+            return
+        key_columns = ["IFNULL({}, X'')".format(col) for col in constants.TRACKS_NATURAL_KEY]
+        self.create_index("tracks_natural_key", "tracks", key_columns, unique = True)
+
+    def create_indexes(self):
+        """
+        Creates the indexes defined in constants.INDEXES and migrates databases created before they existed.
+        """
+
+        cursor = self.db_connection.cursor()
+        self.update_db_description()
+        if self.primary_keys["collections_tracks"] != constants.COLLECTIONS_TRACKS_KEY:
+            #Sqlite can't add a primary key to an existing table, so the table is rebuilt.
+            with self.transaction():
+                cursor.execute("""
+                                    DELETE FROM collections_tracks WHERE rowid NOT IN
+                                    (SELECT MIN(rowid) FROM collections_tracks GROUP BY {})
+                                    """.format(", ".join(constants.COLLECTIONS_TRACKS_KEY)))
+            self.alter_table("collections_tracks", constants.COLLECTIONS_TRACKS_COLS,
+                             constants.COLLECTIONS_TRACKS_CONSTRAINTS)
+            self.update_db_description()
+
+        for index_name, table_name, columns, unique in constants.INDEXES:
+            if index_name in self.indexes:
+                continue
+            if unique and table_name in constants.FOREIGN_KEY_TABLES.values():
+                key_column = [key for key in constants.FOREIGN_KEY_TABLES
+                              if constants.FOREIGN_KEY_TABLES[key] == table_name][0]
+                self.merge_duplicate_names(table_name, key_column, self.foreign_keys[key_column])
+            self.create_index(index_name, table_name, columns, unique)
+
+    def check_query_plans(self):
+        """
+        Checks via EXPLAIN QUERY PLAN that the queries in constants.HOT_QUERIES are answered with indexes.
+
+        @return: A dictionary containing the names of all the queries which scan a whole table and the steps of
+        their plans doing so. If it is empty, all the queries use indexes.
+        """
+
+        full_scans = {}
+        for query_name, sql in constants.HOT_QUERIES.items():
+            scans = [step for step in self.explain_query_plan(sql)
+                     if step.startswith("SCAN") and "INDEX" not in step]
+            if scans:
+                full_scans[query_name] = scans
+        return full_scans
+
+    def merge_duplicate_names(self, table_name, key_column, value_column):
+        """
+        Merges rows of a lookup table sharing the same name into the row with the lowest id.
+        The references in 'tracks' are moved onto the remaining row.
+
+        @param table_name: The name of the lookup table, e.g. 'composers'.
+        @param key_column: The column containing the ids, which is referenced by 'tracks'.
+        @param value_column: The column containing the names.
+        """
+
+        cursor = self.db_connection.cursor()
+        with self.transaction():
+            cursor.execute("DROP TABLE IF EXISTS temp.name_duplicates")
+            cursor.execute("""
+                                CREATE TEMP TABLE name_duplicates AS
+                                SELECT * FROM (SELECT {0} AS duplicate_id, MIN({0}) OVER (PARTITION BY {1}) AS kept_id
+                                               FROM {2} WHERE {1} IS NOT NULL)
+                                WHERE duplicate_id != kept_id
+                                """.format(key_column, value_column, table_name))
+            cursor.execute("SELECT COUNT(*) FROM temp.name_duplicates")
+            has_duplicates = cursor.fetchone()[0] > 0
+            if has_duplicates:
+                #Moving the references can turn tracks into duplicates of each other, so the natural key index is
+                #rebuilt afterwards.
+                cursor.execute("DROP INDEX IF EXISTS tracks_natural_key")
+                cursor.execute("""
+                                    UPDATE tracks SET {0} =
+                                        (SELECT kept_id FROM temp.name_duplicates WHERE duplicate_id = tracks.{0})
+                                    WHERE {0} IN (SELECT duplicate_id FROM temp.name_duplicates)
+                                    """.format(key_column))
+                cursor.execute("DELETE FROM {} WHERE {} IN (SELECT duplicate_id FROM temp.name_duplicates)".format(
+                                    table_name, key_column))
+            cursor.execute("DROP TABLE temp.name_duplicates")
+
+        if has_duplicates:
+            self.invalidate_db_description()
+            self.clear_lookup_caches(table_name)
+            self.create_natural_key_index()
+
+    def merge_duplicate_tracks(self):
+        """
+        Removes tracks sharing the same natural key (see constants.TRACKS_NATURAL_KEY), NULL-values included.
+        Leaves the row with the highest track_id intact and moves the collection memberships of the removed rows onto it.
+        Locations the kept row lacks are taken from the removed rows. Duplicates with different non-NULL locations
+        (see constants.TRACKS_LOCATION_COLS) are kept and reported instead, so no file reference is lost.
+
+        @return: The amount of groups of duplicates which were kept because of conflicting locations.
+        """
+
+        cursor = self.db_connection.cursor()
+        key_columns = ", ".join(constants.TRACKS_NATURAL_KEY)
+        location_columns = ", ".join("MAX({0}) OVER duplicates AS {0}".format(col)
+                                     for col in constants.TRACKS_LOCATION_COLS)
+        #MIN and MAX ignore NULLs, so they only differ if the group contains two different locations.
+        conflicts = " OR ".join("IFNULL(MIN({0}) OVER duplicates != MAX({0}) OVER duplicates, 0)".format(col)
+                                for col in constants.TRACKS_LOCATION_COLS)
+        merged_locations = ", ".join("{0} = IFNULL({0}, (SELECT d.{0} FROM temp.track_duplicates AS d "
+                                     "WHERE d.kept_id = tracks.track_id LIMIT 1))".format(col)
+                                     for col in constants.TRACKS_LOCATION_COLS)
+        with self.transaction():
+            cursor.execute("DROP TABLE IF EXISTS temp.track_duplicates")
+            cursor.execute("""
+                                CREATE TEMP TABLE track_duplicates AS
+                                SELECT * FROM (SELECT track_id, MAX(track_id) OVER duplicates AS kept_id, {1},
+                                                      {2} AS conflicting
+                                               FROM tracks WINDOW duplicates AS (PARTITION BY {0}))
+                                WHERE track_id != kept_id
+                                """.format(key_columns, location_columns, conflicts))
+
+            cursor.execute("""
+                                SELECT kept_id, GROUP_CONCAT(track_id, ', ') FROM temp.track_duplicates
+                                WHERE conflicting GROUP BY kept_id
+                                """)
+            conflicting = cursor.fetchall()
+            for kept_id, track_ids in conflicting:
+                print("Tracks {}, {} are duplicates with different locations and are kept.".format(kept_id,
+                                                                                                  track_ids))
+            cursor.execute("DELETE FROM temp.track_duplicates WHERE conflicting")
+
+            cursor.execute("""
+                                UPDATE tracks SET {}
+                                WHERE track_id IN (SELECT kept_id FROM temp.track_duplicates)
+                                """.format(merged_locations))
+            #Memberships the kept row already has are ignored here and deleted afterwards.
+            cursor.execute("""
+                                UPDATE OR IGNORE collections_tracks SET track_id =
+                                    (SELECT kept_id FROM temp.track_duplicates AS d
+                                     WHERE d.track_id = collections_tracks.track_id)
+                                WHERE track_id IN (SELECT track_id FROM temp.track_duplicates)
+                                """)
+            cursor.execute("""
+                                DELETE FROM collections_tracks
+                                WHERE track_id IN (SELECT track_id FROM temp.track_duplicates)
+                                """)
+            cursor.execute("DELETE FROM tracks WHERE track_id IN (SELECT track_id FROM temp.track_duplicates)")
+            cursor.execute("DROP TABLE temp.track_duplicates")
+        return len(conflicting)
+
     def input_entries(self, *args):
         """
         Handles the input of track-data into the correct tables.
+        Entries which already exist (see constants.TRACKS_NATURAL_KEY) are skipped by the unique index
+        'tracks_natural_key', so the duplicate check happens inside the single INSERT-statement.
+        As long as the index is missing (see create_natural_key_index()), every row is only inserted if no track with
+        the same natural key exists, which is checked with the index on track_name.
 
         A parameter must have all the columns defined in constants.TRACK_INSERT_COLS
+        @return: A tuple containing the amount of inserted and skipped entries.
         """
 
-        sql =   """
-                INSERT OR REPLACE INTO
-                    tracks {}
-                VALUES (
-                """.format(tuple(self.insert_cols))
-        sql += ("?, "*(len(self.insert_cols)-1)) + "?)"
-
-        data = []
-        for entry in args:
-            #Fetching foreign key values
-            if entry[2]:
-                entry[2] = self.get_foreign_key_value("interpreters", "interpreter_id", "interpreter_name", entry[2])
-            if entry[3]:
-                entry[3] = self.get_foreign_key_value("composers", "composer_id", "composer_name", entry[3])
-            if entry[4]:
-                entry[4] = self.get_foreign_key_value("genres", "genre_id", "genre_name", entry[4])
-            entry_line = tuple(entry)
-            #print("ENTRY LINE: ",entry_line)
-            with self.db_connection:
-                self.cursor.execute("""
-                                    SELECT * FROM tracks WHERE  track_name = ? AND year = ? AND interpreter_id = ? AND
-                                                                composer_id = ? AND genre_id = ?
-                                    """, entry_line[0:5])
-                if not self.cursor.fetchone():
-                    #print(self.cursor.fetchall())
-                    data.append(entry_line)
-        with self.db_connection:
-            if len(data) > 1:
-                self.cursor.executemany(sql, data)
-            elif len(data) == 1:
-                #print(data[0])
-                self.cursor.execute(sql, data[0])
+        cursor = self.db_connection.cursor()
+        self.update_db_description()
+        if "tracks_natural_key" in self.indexes:
+            sql =   """
+                    INSERT INTO
+                        tracks ({})
+                    VALUES {}
+                    ON CONFLICT DO NOTHING
+                    """.format(", ".join(self.insert_cols), create_placeholders(len(self.insert_cols)))
+            key_positions = []
+        else:
+            #'IS' treats two NULLs as equal, like the IFNULL()-expressions of the index.
+            sql =   """
+                    INSERT INTO
+                        tracks ({})
+                    SELECT {}
+                    WHERE NOT EXISTS (SELECT 1 FROM tracks WHERE {})
+                    """.format(", ".join(self.insert_cols), ", ".join("?" * len(self.insert_cols)),
+                               " AND ".join("{} IS ?".format(col) for col in constants.TRACKS_NATURAL_KEY))
+            key_positions = [self.insert_cols.index(col) for col in constants.TRACKS_NATURAL_KEY]
+
+        #Fetching foreign key values, one batch per lookup table
+        for key_column in ("interpreter_id", "composer_id", "genre_id"):
+            position = self.insert_cols.index(key_column)
+            keys = self.get_foreign_key_values(constants.FOREIGN_KEY_TABLES[key_column], key_column,
+                                               self.foreign_keys[key_column],
+                                               [entry[position] for entry in args if entry[position]])
+            for entry in args:
+                if entry[position]:
+                    entry[position] = keys[entry[position]]
+
+        data = [tuple(entry) + tuple(entry[position] for position in key_positions) for entry in args]
+        inserted = 0
+        if data:
+            with self.transaction():
+                cursor.executemany(sql, data)
+                inserted = cursor.rowcount
+        return inserted, len(data) - inserted
 
 
     def change_entry(self, entry):
         """
         Updates the whole entry in the database.
         """
+        cursor = self.db_connection.cursor()
         #TODO: FOREIGN KEYS?
         change_cols = " = ?,".join(self.insert_cols) + " = ?"
         sql = "UPDATE tracks SET {} WHERE track_id = ?".format(change_cols)
-        values = []
-        for col in entry.data[1:]:
-            values.append(col[1])
-        values.append(entry.data[0][1])
+        values = list(entry[1:])
+        values.append(entry.track_id)
         print(sql)
-        with self.db_connection:
-            self.cursor.execute(sql, values)
+        with self.transaction():
+            cursor.execute(sql, values)
 
 
     def change_value(self, table_name, col, value, key_table = None, con = None):
@@ -525,52 +1282,93 @@ class TrackDbHandler(DbHandler):
         Clears all the tables in the Database.
         """
 
+        self.update_db_description()
         temp_tables = self.tables[:]
-        for table in temp_tables:
-            self.drop_table(table)
+        with self.batch():
+            for table in temp_tables:
+                self.drop_table(table)
+        self.clear_lookup_caches()
 
     def remove_duplicates(self):
         """
         Removes duplicate rows in the 'tracks' table. Leaves the row with the highest track_id intact.
         """
 
+        cursor = self.db_connection.cursor()
         sql =   """
                 DELETE FROM tracks WHERE track_id NOT IN
                 (SELECT MAX(track_id) FROM tracks GROUP BY  track_name, year, interpreter_id, composer_id, genre_id,
                                                             media_location, sheet_location, thumbnail_location)
                 """
-        with self.db_connection:
-            self.cursor.execute(sql)
+        with self.transaction():
+            cursor.execute(sql)
+
+class EntryData:
+    """
+    A read-only view of an entry as a list of (name, value)-pairs, e.g. entry.data[1] == ("Track", "Prälude 1").
+    Exists for code written against the former list-based Entry, which used entry.data[i][1].
+    """
+
+    __slots__ = ("entry",)
 
-class Entry:
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return list(zip(Entry.names[position], self.entry[position]))
+        return Entry.names[position], self.entry[position]
+
+    def __len__(self):
+        return len(self.entry)
+
+    def __iter__(self):
+        return zip(Entry.names, self.entry)
+
+
+class Entry(namedtuple("EntryRow", [col.split(".")[1] for col in constants.ENTRY_COLS_SORTED])):
     """
-    Represents the data inside one row of the 'tracks' table.
+    Represents the data inside one row of the 'tracks' table, joined as in constants.ENTRY_COLS_SORTED.
+    An entry is an immutable tuple: fields can be accessed by index (entry[1]), by column name (entry.track_name)
+    or by trivial name (entry.get("Track")). The names are stored once in the class and shared by every entry.
     """
 
-    def __init__(self, data):
-        self.names = constants.ENTRY_COLS_NAMES
-        self.data = []
-        self.set_data(data)
+    __slots__ = ()
+
+    #Trivial names of the fields as in constants.ENTRY_COLS_NAMES
+    names = tuple(constants.ENTRY_COLS_NAMES)
+
+    def __new__(cls, data):
+        return super(Entry, cls).__new__(cls, *data)
 
-    def set_data(self, result_data):
-        self.data = []
-        for name, data in zip(self.names, result_data):
-            self.data.append([name,data])
+    @property
+    def data(self):
+        return EntryData(self)
+
+    def get(self, name):
+        """
+        Returns the value of a field by its trivial name, e.g. entry.get("Komponist").
+        """
+
+        return self[self.names.index(name)]
 
     def save_data(self, db, data):
-        self.data = []
-        for name, data_line in zip(self.names, data):
-            self.data.append([name,data_line])
-        db.change_entry(self)
+        """
+        Writes new data for this entry into the database.
+        Entries are immutable, so the changed entry is returned as new object.
+        """
+
+        entry = Entry(data)
+        db.change_entry(entry)
+        return entry
 
     def get_track_id(self):
-        print(self.data)
-        return self.data[0][1]
+        return self.track_id
 
     def __str__(self):
         output = ""
-        for line in self.data:
-            output += " {}: {}\n".format(line[0], line[1])
+        for name, value in zip(self.names, self):
+            output += " {}: {}\n".format(name, value)
         return output
 
 
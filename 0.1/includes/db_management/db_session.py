@@ -0,0 +1,50 @@
+import os
+import threading
+
+import constants
+import db_interface
+
+
+#The opened handlers by database path. Nothing is opened before a handler is requested.
+_handlers = {}
+#Background threads may request a handler at the same time as the GUI thread.
+_handlers_lock = threading.Lock()
+
+
+def get_db(db_name = constants.MAIN_DB_PATH):
+    """
+    Returns the TrackDbHandler shared by all parts of the program for db_name.
+    The handler may be used from any thread, every thread gets its own connection.
+    The database is opened (and its tables are created) on the first call, not at import time.
+
+    @param db_name: The path of the database, per default constants.MAIN_DB_PATH.
+    """
+
+    with _handlers_lock:
+        if db_name not in _handlers:
+            directory = os.path.dirname(db_name)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            _handlers[db_name] = db_interface.TrackDbHandler(db_name)
+        return _handlers[db_name]
+
+
+def set_db(db, db_name = constants.MAIN_DB_PATH):
+    """
+    Registers an already opened handler, which get_db(db_name) returns from then on.
+    Used to inject e.g. a handler of a test database.
+    """
+
+    _handlers[db_name] = db
+
+
+def close_db(db_name = None):
+    """
+    Forgets the handler of db_name or, if no name is given, all handlers.
+    The connections are closed as soon as no widget references them anymore.
+    """
+
+    if db_name is None:
+        _handlers.clear()
+    else:
+        _handlers.pop(db_name, None)
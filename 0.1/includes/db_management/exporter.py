@@ -0,0 +1,148 @@
+import os
+import csv
+import gzip
+import json
+import shutil
+import sqlite3
+
+from misc import constants
+
+
+class TrackExporter:
+    """
+    Exports the tracks, a single collection or the whole database into files.
+    The rows are read from an open cursor in batches and written right away, so the memory used doesn't depend on
+    the size of the catalog. Every file is written under a temporary name first and only replaces the target once
+    it is complete. Files ending with '.gz' are compressed with gzip.
+    """
+
+    def __init__(self, db):
+        """
+        @param db: The TrackDbHandler of the database to export from.
+        """
+
+        self.db = db
+        #The column names of the exported tracks, e.g. 'composer_name'. TrackImporter maps them back automatically.
+        self.columns = [column.split(".")[1] for column in constants.ENTRY_COLS_SORTED]
+
+    def iter_rows(self, collection_id = None, batch_size = 1000):
+        """
+        Steps through the joined tracks, or the tracks of one collection, ordered by track_id.
+
+        @param collection_id: If this is given, only the tracks of this collection are returned.
+        @param batch_size: The amount of rows fetched from sqlite at once.
+        @return: A generator yielding the rows as tuples in the order of constants.ENTRY_COLS_SORTED.
+        """
+
+        sql = "SELECT {} FROM {}".format(", ".join(constants.ENTRY_COLS_SORTED), constants.JOIN_COLS)
+        parameters = ()
+        if collection_id is not None:
+            sql += " JOIN collections_tracks ON collections_tracks.track_id = tracks.track_id " \
+                   "WHERE collections_tracks.collection_id = ?"
+            parameters = (collection_id,)
+        sql += " ORDER BY tracks.track_id"
+
+        cursor = self.db.db_connection.cursor()
+        cursor.execute(sql, parameters)
+        try:
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                for row in rows:
+                    yield row
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
+
+    def open_file(self, path, compress):
+        if compress:
+            return gzip.open(path, "wt", encoding = "utf-8", newline = "")
+        return open(path, "w", encoding = "utf-8", newline = "")
+
+    def export(self, path, file_format = None, collection_id = None, compress = None):
+        """
+        Exports into path in the format given by its extension: '.csv', '.jsonl' or '.db', optionally followed by '.gz'.
+
+        @param file_format: Either "csv", "jsonl" or "db", per default taken from the extension of path.
+        @param collection_id: Only exports the tracks of this collection. Not possible for "db".
+        @param compress: If this is true, the file is compressed with gzip. Per default if path ends with '.gz'.
+        @return: The amount of exported tracks, or None for a database.
+        """
+
+        name = path[:-3] if path.lower().endswith(".gz") else path
+        if compress is None:
+            compress = name != path
+        if file_format is None:
+            file_format = os.path.splitext(name)[1].lower().lstrip(".")
+
+        if file_format == "db":
+            self.export_database(path, compress)
+            return None
+        if file_format in ("jsonl", "ndjson"):
+            return self.export_jsonl(path, collection_id, compress)
+        return self.export_csv(path, collection_id, compress)
+
+    def export_csv(self, path, collection_id = None, compress = False):
+        """
+        Writes the tracks into a CSV-file with the column names as first row.
+
+        @return: The amount of exported tracks.
+        """
+
+        temp_path = path + ".tmp"
+        count = 0
+        with self.open_file(temp_path, compress) as file:
+            writer = csv.writer(file)
+            writer.writerow(self.columns)
+            for row in self.iter_rows(collection_id):
+                writer.writerow(row)
+                count += 1
+        os.replace(temp_path, path)
+        return count
+
+    def export_jsonl(self, path, collection_id = None, compress = False):
+        """
+        Writes the tracks into a JSON-Lines-file, one object per track.
+
+        @return: The amount of exported tracks.
+        """
+
+        temp_path = path + ".tmp"
+        count = 0
+        with self.open_file(temp_path, compress) as file:
+            for row in self.iter_rows(collection_id):
+                file.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii = False))
+                file.write("\n")
+                count += 1
+        os.replace(temp_path, path)
+        return count
+
+    def export_database(self, path, compress = False, pages = 1024):
+        """
+        Copies the whole database into a standalone file with the online backup API of sqlite.
+        The copy is consistent, even if the database is written to meanwhile.
+        """
+
+        temp_path = path + ".tmp"
+        database_path = temp_path + ".db" if compress else temp_path
+        target = sqlite3.connect(database_path)
+        try:
+            self.db.db_connection.backup(target, pages = pages)
+            #The copy has to be readable on its own, without the -wal file next to it.
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+
+        if compress:
+            with open(database_path, "rb") as source, gzip.open(temp_path, "wb") as file:
+                shutil.copyfileobj(source, file, 1024 * 1024)
+            os.remove(database_path)
+        os.replace(temp_path, path)
+
+
+if __name__ == "__main__":
+    import sys
+    import db_interface
+
+    exporter = TrackExporter(db_interface.TrackDbHandler(constants.MAIN_DB_PATH))
+    for target in sys.argv[1:]:
+        print("{}: {}".format(target, exporter.export(target)))
@@ -0,0 +1,143 @@
+import os
+import csv
+import json
+import time
+import itertools
+
+from misc import constants
+
+
+def read_csv(path, delimiter = None):
+    """
+    Reads a CSV-file row by row. The first row has to contain the column names.
+
+    @param delimiter: The delimiter of the columns, it is guessed from the start of the file if none is given.
+    @return: A generator yielding a dictionary per row.
+    """
+
+    with open(path, newline = "", encoding = "utf-8-sig") as file:
+        if delimiter is None:
+            try:
+                delimiter = csv.Sniffer().sniff(file.read(64 * 1024), delimiters = ",;\t|").delimiter
+            except csv.Error:
+                delimiter = ","
+            file.seek(0)
+        for row in csv.DictReader(file, delimiter = delimiter):
+            yield row
+
+
+def read_jsonl(path):
+    """
+    Reads a JSON-Lines-file, which contains one JSON-object per line. Empty lines are skipped.
+
+    @return: A generator yielding a dictionary per line.
+    """
+
+    with open(path, encoding = "utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TrackImporter:
+    """
+    Streams tracks out of CSV- or JSON-Lines-files into a TrackDbHandler.
+    The rows are read incrementally and written in chunks, each in its own transaction together with a checkpoint.
+    An interrupted import of the same (unchanged) file continues after the last written chunk.
+    """
+
+    def __init__(self, db, mapping = None):
+        """
+        @param db: The TrackDbHandler the tracks are imported into.
+        @param mapping: A dictionary mapping the column names of the source onto the names in
+        constants.TRACK_INSERT_COLS, e.g. {"Titel": "track_name"}. Columns which already carry such a name, the name
+        of the referenced lookup column (e.g. "composer_name") or a name out of constants.ENTRY_COLS_NAMES are mapped
+        automatically, ignoring case.
+        """
+
+        self.db = db
+        self.db.create_table("import_checkpoints", constants.IMPORT_CHECKPOINT_COLS)
+
+        self.columns = {}
+        for column in constants.TRACK_INSERT_COLS:
+            self.columns[column.lower()] = column
+        for key_column, name_column in constants.FOREIGN_KEYS.items():
+            self.columns[name_column.lower()] = key_column
+        for name, column in zip(constants.ENTRY_COLS_NAMES, constants.ENTRY_COLS_SORTED):
+            column = column.split(".")[1]
+            column = self.columns.get(column.lower())
+            if column:
+                self.columns[name.lower()] = column
+        for source, column in (mapping or {}).items():
+            self.columns[source.lower()] = column
+
+    def convert_row(self, row):
+        """
+        Turns a row of the source into the list of values input_entries() expects. Empty strings become None.
+        """
+
+        values = [None] * len(constants.TRACK_INSERT_COLS)
+        for source, value in row.items():
+            column = self.columns.get(source.lower()) if source else None
+            if column is None or value == "":
+                continue
+            values[constants.TRACK_INSERT_COLS.index(column)] = value
+        return values
+
+    def import_file(self, path, file_format = None, chunk_size = 1000, resume = True, progress = None):
+        """
+        Imports all rows of a file.
+
+        @param path: The path of the CSV- or JSON-Lines-file.
+        @param file_format: Either "csv" or "jsonl", per default taken from the extension of the file.
+        @param chunk_size: The amount of rows written per transaction.
+        @param resume: If this is false, an existing checkpoint is ignored and the import starts at the first row.
+        @param progress: A function called after every chunk as progress(rows, rows_per_second). Prints per default.
+        @return: A tuple containing the amount of inserted and skipped (already existing) tracks.
+        """
+
+        if file_format is None:
+            file_format = "jsonl" if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson") else "csv"
+        rows = read_jsonl(path) if file_format == "jsonl" else read_csv(path)
+        if progress is None:
+            progress = lambda count, rate: print("{} rows imported ({:.0f} rows/s)".format(count, rate))
+
+        source_path = os.path.abspath(path)
+        stat = os.stat(source_path)
+        position, inserted, skipped = 0, 0, 0
+        checkpoint = self.db.fetch_table("import_checkpoints", ["size", "mtime", "position", "inserted", "skipped"],
+                                         [("source_path =", source_path)])
+        #A checkpoint is only valid as long as the file hasn't changed.
+        if resume and checkpoint and tuple(checkpoint[0][:2]) == (stat.st_size, stat.st_mtime):
+            position, inserted, skipped = checkpoint[0][2:]
+            rows = itertools.islice(rows, position, None)
+
+        cursor = self.db.db_connection.cursor()
+        start_time = time.perf_counter()
+        start_position = position
+        while True:
+            chunk = [self.convert_row(row) for row in itertools.islice(rows, chunk_size)]
+            if not chunk:
+                break
+            with self.db.transaction():
+                chunk_inserted, chunk_skipped = self.db.input_entries(*chunk)
+                position += len(chunk)
+                inserted += chunk_inserted
+                skipped += chunk_skipped
+                cursor.execute("INSERT OR REPLACE INTO import_checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                               (source_path, stat.st_size, stat.st_mtime, position, inserted, skipped))
+            elapsed = time.perf_counter() - start_time
+            progress(position, (position - start_position) / elapsed if elapsed else 0.0)
+
+        with self.db.transaction():
+            cursor.execute("DELETE FROM import_checkpoints WHERE source_path = ?", (source_path,))
+        return inserted, skipped
+
+
+if __name__ == "__main__":
+    import sys
+    import db_interface
+
+    importer = TrackImporter(db_interface.TrackDbHandler(constants.MAIN_DB_PATH))
+    for source in sys.argv[1:]:
+        print("{}: {} inserted, {} skipped".format(source, *importer.import_file(source)))
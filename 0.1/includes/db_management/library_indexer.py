@@ -0,0 +1,192 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from misc import constants, data_linking, helper_functions
+
+
+def hash_path(path):
+    """
+    Hashes one file. Runs inside a worker process of LibraryIndexer.
+
+    @return: A tuple containing path and the SHA-256 hex digest of the file, which is None if it couldn't be read.
+    """
+
+    try:
+        return path, helper_functions.hash_file(path)
+    except OSError:
+        return path, None
+
+
+class LibraryIndexer:
+    """
+    Keeps the table 'file_index' up to date with the media and sheet files below a root directory.
+    Every file is recorded with its size, mtime and content hash. On a rescan only files whose size or mtime changed
+    are hashed again, in a process pool. Files which disappeared are kept as not present, so a moved file can be found
+    again by its hash. Locations can then be resolved and verified with queries, without touching the filesystem.
+    """
+
+    def __init__(self, db, root = None, linking_handler = None):
+        """
+        @param db: The TrackDbHandler of the database containing the tracks.
+        @param root: The directory to index, per default the data root directory of the linking handler.
+        @param linking_handler: The LinkingHandler used to walk through the directories.
+        """
+
+        self.db = db
+        self.linking = linking_handler or data_linking.LinkingHandler()
+        self.root = os.path.abspath(root or self.linking.root)
+        self.db.create_table("file_index", constants.FILE_INDEX_COLS)
+        self.db.create_index("file_index_content_hash", "file_index", ["content_hash"])
+
+    def update_index(self, max_workers = None, chunk_size = 16, batch_size = 500):
+        """
+        Scans the root directory and writes the changes into the index.
+
+        @param max_workers: The amount of hashing processes, per default one per core.
+        @param chunk_size: The amount of files handed out to a worker at once.
+        @param batch_size: The amount of rows written per transaction, so an interrupted scan keeps its progress.
+        @return: A tuple containing the amount of hashed, unchanged and disappeared files.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        with self.db.db_connection:
+            cursor.execute("SELECT path, size, mtime, content_hash, present FROM file_index "
+                           "WHERE path > ? AND path < ?", (self.root + os.sep, self.root + chr(ord(os.sep) + 1)))
+            indexed = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        stats = {}
+        outdated = []
+        reappeared = []
+        for path, size, mtime in self.linking.get_files(self.root, constants.LIBRARY_FILE_TYPES,
+                                                        constants.LIBRARY_EXCLUDED_DIRECTORIES):
+            stats[path] = (size, mtime)
+            row = indexed.get(path)
+            if row is None or row[:2] != (size, mtime) or row[2] is None:
+                outdated.append(path)
+            elif not row[3]:
+                reappeared.append((path,))
+
+        hashed = 0
+        rows = []
+        for path, content_hash in self.hash_files(outdated, max_workers, chunk_size):
+            if content_hash is None:
+                continue
+            rows.append((path, stats[path][0], stats[path][1], content_hash))
+            hashed += 1
+            if len(rows) >= batch_size:
+                self.write_rows(rows)
+                rows = []
+        self.write_rows(rows)
+
+        disappeared = [(path,) for path, row in indexed.items() if row[3] and path not in stats]
+        with self.db.transaction():
+            cursor.executemany("UPDATE file_index SET present = 1 WHERE path = ?", reappeared)
+            cursor.executemany("UPDATE file_index SET present = 0 WHERE path = ?", disappeared)
+        return hashed, len(stats) - len(outdated), len(disappeared)
+
+    def hash_files(self, paths, max_workers = None, chunk_size = 16):
+        """
+        Hashes the files in a process pool, or directly if there are too few of them to be worth starting one.
+
+        @return: A generator yielding tuples (path, content hash) in the order of paths, see hash_path().
+        """
+
+        if len(paths) <= chunk_size:
+            for path in paths:
+                yield hash_path(path)
+            return
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            for result in executor.map(hash_path, paths, chunksize = chunk_size):
+                yield result
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        cursor = self.db.db_connection.cursor()
+        with self.db.transaction():
+            cursor.executemany("INSERT OR REPLACE INTO file_index (path, size, mtime, content_hash, present) "
+                               "VALUES (?, ?, ?, ?, 1)", rows)
+
+    def get_file(self, path):
+        """
+        Returns a tuple containing size, mtime, content hash and presence of an indexed file or None.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        cursor.execute("SELECT size, mtime, content_hash, present FROM file_index WHERE path = ?",
+                       (os.path.abspath(path),))
+        return cursor.fetchone()
+
+    def find_by_hash(self, content_hash):
+        """
+        Returns the paths of all present files with the given content, e.g. to find duplicates.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        cursor.execute("SELECT path FROM file_index WHERE content_hash = ? AND present = 1 ORDER BY path",
+                       (content_hash,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def resolve(self, path):
+        """
+        Returns the current path of an indexed file: path itself if the file is present,
+        the path of a present file with the same content if it was moved, or None if it is missing or not indexed.
+        """
+
+        row = self.get_file(path)
+        if row is None:
+            return None
+        if row[3]:
+            return os.path.abspath(path)
+        paths = self.find_by_hash(row[2])
+        if paths:
+            return paths[0]
+        return None
+
+    def verify_locations(self, relink = False):
+        """
+        Checks the media_location and sheet_location of all tracks against the index with one query per column.
+
+        @param relink: If this is true, the locations of moved files are replaced by their new path.
+        @return: A list of tuples (track_id, column, location, status, new location) for every location which isn't
+        present. The status is 'moved', 'missing' or 'unindexed', the new location is None unless the file was moved.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        problems = []
+        for column in ("media_location", "sheet_location"):
+            sql =   """
+                    SELECT tracks.track_id, tracks.{0}, file_index.present,
+                        (SELECT moved.path FROM file_index AS moved
+                         WHERE moved.content_hash = file_index.content_hash AND moved.present = 1
+                         ORDER BY moved.path LIMIT 1)
+                    FROM tracks LEFT JOIN file_index ON file_index.path = tracks.{0}
+                    WHERE tracks.{0} IS NOT NULL AND file_index.present IS NOT 1
+                    """.format(column)
+            with self.db.db_connection:
+                cursor.execute(sql)
+                for track_id, location, present, new_location in cursor.fetchall():
+                    if present is None:
+                        status = "unindexed"
+                    elif new_location:
+                        status = "moved"
+                    else:
+                        status = "missing"
+                    problems.append((track_id, column, location, status, new_location))
+
+        if relink:
+            with self.db.transaction():
+                for column in ("media_location", "sheet_location"):
+                    cursor.executemany("UPDATE tracks SET {} = ? WHERE track_id = ?".format(column),
+                                       [(problem[4], problem[0]) for problem in problems
+                                        if problem[1] == column and problem[3] == "moved"])
+        return problems
+
+
+if __name__ == "__main__":
+    import db_interface
+
+    indexer = LibraryIndexer(db_interface.TrackDbHandler(constants.MAIN_DB_PATH))
+    print(indexer.update_index())
+    for problem in indexer.verify_locations():
+        print(problem)
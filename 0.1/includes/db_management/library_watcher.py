@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+
+from misc import constants, helper_functions
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    #Without inotify_simple (or on other systems than Linux) the library is polled instead.
+    INotify = None
+
+
+class LibraryWatcher:
+    """
+    Keeps the file index and the locations of the tracks current while the program runs.
+    Changes below the root of a LibraryIndexer are collected via inotify, or by polling the stats of the files if
+    inotify isn't available. Once no new change arrived for the debounce interval, the collected paths are processed
+    in one batch: changed files are hashed, and a file which disappeared while a file with the same content appeared
+    counts as renamed, so the tracks referencing the old path are moved to the new one.
+    """
+
+    def __init__(self, indexer, debounce = 1.0, max_delay = 10.0, poll_interval = 5.0):
+        """
+        @param indexer: The LibraryIndexer whose root and file index are watched.
+        @param debounce: The amount of seconds without changes before a batch is processed.
+        @param max_delay: The maximal amount of seconds a change waits, even if further changes keep arriving.
+        @param poll_interval: The amount of seconds between two scans if the library is polled.
+        """
+
+        self.indexer = indexer
+        self.db = indexer.db
+        self.root = indexer.root
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.excluded = [os.path.abspath(directory) for directory in constants.LIBRARY_EXCLUDED_DIRECTORIES]
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.inotify = None
+        #The watched directories by watch descriptor.
+        self.directories = {}
+        #The stats of all files by path, only used when polling.
+        self.snapshot = None
+
+    def start(self):
+        """
+        Starts watching in a background thread.
+        """
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target = self.run, name = "library-watcher", daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Watches until stop() is called. Blocks, see start() to run it in the background.
+        """
+
+        if INotify is not None:
+            self.run_inotify()
+        else:
+            self.run_polling()
+        self.db.pool.close_connection()
+
+    #inotify
+
+    def run_inotify(self):
+        self.inotify = INotify()
+        self.add_watches(self.root)
+        pending = set()
+        first_change = None
+        try:
+            while not self.stop_event.is_set():
+                events = self.inotify.read(timeout = int(self.debounce * 1000))
+                for event in events:
+                    if event.mask & flags.Q_OVERFLOW:
+                        #Events were lost, so the only way to be sure is a full scan. Renames among the lost events
+                        #are found by their hash when the locations are verified.
+                        pending.clear()
+                        self.indexer.update_index()
+                        self.indexer.verify_locations(relink = True)
+                        continue
+                    pending.update(self.handle_event(event))
+                if pending and first_change is None:
+                    first_change = time.monotonic()
+                if pending and (not events or time.monotonic() - first_change >= self.max_delay):
+                    self.process_changes(pending)
+                    pending = set()
+                    first_change = None
+        finally:
+            self.inotify.close()
+            self.inotify = None
+            self.directories.clear()
+
+    def add_watches(self, directory):
+        """
+        Watches directory and all its subdirectories. inotify isn't recursive, so every directory needs a watch.
+        """
+
+        mask = flags.CREATE | flags.CLOSE_WRITE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.DELETE_SELF
+        for path, dirs, files in self.indexer.linking.get_walk(directory):
+            dirs[:] = [name for name in dirs if os.path.join(path, name) not in self.excluded]
+            try:
+                self.directories[self.inotify.add_watch(path, mask)] = path
+            except OSError as e:
+                print("{} can't be watched: {}".format(path, e))
+
+    def handle_event(self, event):
+        """
+        Returns the paths of the files affected by one inotify event.
+        """
+
+        if event.mask & flags.IGNORED:
+            self.directories.pop(event.wd, None)
+            return []
+        directory = self.directories.get(event.wd)
+        if directory is None or not event.name:
+            return []
+        path = os.path.join(directory, event.name)
+
+        if event.mask & flags.ISDIR:
+            if path in self.excluded:
+                return []
+            if event.mask & (flags.CREATE | flags.MOVED_TO):
+                #Files may have been created before the new watch exists, so the directory is scanned once.
+                self.add_watches(path)
+                return [file[0] for file in self.indexer.linking.get_files(path, constants.LIBRARY_FILE_TYPES,
+                                                                             self.excluded)]
+            #A directory which was moved away or deleted takes all of its indexed files with it.
+            return self.get_indexed_paths(path)
+        return [path]
+
+    def get_indexed_paths(self, directory):
+        cursor = self.db.db_connection.cursor()
+        cursor.execute("SELECT path FROM file_index WHERE path > ? AND path < ? AND present = 1",
+                       (directory + os.sep, directory + chr(ord(os.sep) + 1)))
+        return [row[0] for row in cursor.fetchall()]
+
+    #Polling
+
+    def run_polling(self):
+        pending = set()
+        first_change = None
+        while not self.stop_event.wait(self.poll_interval if not pending else self.debounce):
+            changed = self.poll()
+            pending.update(changed)
+            if pending and first_change is None:
+                first_change = time.monotonic()
+            if pending and (not changed or time.monotonic() - first_change >= self.max_delay):
+                self.process_changes(pending)
+                pending = set()
+                first_change = None
+
+    def poll(self):
+        """
+        Returns the paths of the files which appeared, changed or disappeared since the last call.
+        The first call compares against the file index.
+        """
+
+        if self.snapshot is None:
+            cursor = self.db.db_connection.cursor()
+            cursor.execute("SELECT path, size, mtime FROM file_index WHERE path > ? AND path < ? AND present = 1",
+                           (self.root + os.sep, self.root + chr(ord(os.sep) + 1)))
+            self.snapshot = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+        snapshot = {path: (size, mtime) for path, size, mtime in
+                    self.indexer.linking.get_files(self.root, constants.LIBRARY_FILE_TYPES, self.excluded)}
+        changed = [path for path, stat in snapshot.items() if self.snapshot.get(path) != stat]
+        changed.extend(path for path in self.snapshot if path not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    #Processing
+
+    def process_changes(self, paths):
+        """
+        Updates the file index and the tracks for a batch of changed paths in one transaction.
+
+        @param paths: The paths of files which may have appeared, changed or disappeared.
+        @return: A tuple containing the amount of hashed, disappeared and renamed files.
+        """
+
+        paths = sorted(path for path in paths if os.path.splitext(path)[1].lower() in constants.LIBRARY_FILE_TYPES)
+        cursor = self.db.db_connection.cursor()
+        indexed = {}
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start+500]
+            cursor.execute("SELECT path, size, mtime, content_hash, present FROM file_index WHERE path IN " +
+                           helper_functions.create_placeholders(len(chunk)), chunk)
+            indexed.update((row[0], row[1:]) for row in cursor.fetchall())
+
+        stats = {}
+        gone = []
+        for path in paths:
+            row = indexed.get(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is None or not os.path.isfile(path):
+                if row and row[3]:
+                    gone.append(path)
+            elif not row or row[:2] != (stat.st_size, stat.st_mtime) or not row[2] or not row[3]:
+                stats[path] = (stat.st_size, stat.st_mtime)
+
+        rows = []
+        appeared = {}
+        for path, content_hash in self.indexer.hash_files(list(stats)):
+            if content_hash is not None:
+                rows.append((path, stats[path][0], stats[path][1], content_hash))
+                appeared.setdefault(content_hash, path)
+
+        renames = []
+        for path in gone:
+            new_path = appeared.get(indexed[path][2])
+            if new_path is None:
+                #The content may also have appeared earlier, e.g. if a copy was made before the original was deleted.
+                new_path = next((other for other in self.indexer.find_by_hash(indexed[path][2])
+                                 if other not in gone), None)
+            if new_path:
+                renames.append((new_path, path))
+
+        with self.db.transaction():
+            cursor.executemany("INSERT OR REPLACE INTO file_index (path, size, mtime, content_hash, present) "
+                               "VALUES (?, ?, ?, ?, 1)", rows)
+            cursor.executemany("UPDATE file_index SET present = 0 WHERE path = ?", [(path,) for path in gone])
+            for column in ("media_location", "sheet_location"):
+                cursor.executemany("UPDATE tracks SET {0} = ? WHERE {0} = ?".format(column), renames)
+        return len(rows), len(gone), len(renames)
+
+
+if __name__ == "__main__":
+    import db_interface
+    import library_indexer
+
+    indexer = library_indexer.LibraryIndexer(db_interface.TrackDbHandler(constants.MAIN_DB_PATH))
+    print(indexer.update_index())
+    watcher = LibraryWatcher(indexer)
+    print("Watching {} ({})".format(indexer.root, "inotify" if INotify else "polling"))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
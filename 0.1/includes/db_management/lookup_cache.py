@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+
+class LookupCache:
+    """
+    A size-bounded name->id cache for one lookup table (e.g. 'composers').
+    When the cache is full, the entry which was used least recently is dropped.
+    The cache may be used by several threads at once.
+    """
+
+    def __init__(self, table_name, key_column, value_column, max_size = 10000):
+        """
+        @param table_name: The name of the lookup table.
+        @param key_column: The column containing the ids, e.g. 'composer_id'.
+        @param value_column: The column containing the names, e.g. 'composer_name'.
+        @param max_size: The maximal amount of names held in the cache.
+        """
+
+        self.table_name = table_name
+        self.key_column = key_column
+        self.value_column = value_column
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, value):
+        return value in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, value):
+        """
+        Returns the id corresponding to value or None if value isn't cached.
+        """
+
+        with self.lock:
+            try:
+                self.entries.move_to_end(value)
+            except KeyError:
+                return None
+            return self.entries[value]
+
+    def put(self, value, key):
+        """
+        Stores the id of value in the cache. Keeps the first id if the name is already cached,
+        because this is the id an uncached lookup would return as well.
+        """
+
+        if value is None:
+            return
+        with self.lock:
+            if value in self.entries:
+                self.entries.move_to_end(value)
+                return
+            self.entries[value] = key
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+    def discard_value(self, value):
+        with self.lock:
+            self.entries.pop(value, None)
+
+    def discard_key(self, key):
+        with self.lock:
+            for value in [value for value, cached_key in self.entries.items() if cached_key == key]:
+                del self.entries[value]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,198 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from misc import constants, helper_functions
+
+try:
+    import fitz
+except ImportError:
+    #Without PyMuPDF no thumbnails are generated for PDFs.
+    fitz = None
+
+
+def create_thumbnail(source_path, thumbnail_directory, size):
+    """
+    Generates the thumbnail of one file. Runs inside a worker process of ThumbnailGenerator.
+    The thumbnail is stored under the hash of the file's content and the target size, so identical files share one
+    thumbnail, a file which was only touched or moved doesn't need a new one and a changed
+    constants.THUMBNAIL_SIZE never reuses thumbnails of the old size.
+
+    @param source_path: The image or PDF to create the thumbnail of.
+    @param thumbnail_directory: The root of the content-addressed thumbnail directory.
+    @param size: A tuple (width, height) the thumbnail is scaled to fit into.
+    @return: A tuple containing source_path, the content hash and the path of the thumbnail,
+    the latter two are None if no thumbnail could be created.
+    """
+
+    try:
+        content_hash = helper_functions.hash_file(source_path)
+    except OSError:
+        return source_path, None, None
+
+    thumbnail_path = os.path.join(thumbnail_directory, content_hash[:2],
+                                  "{}_{}x{}.png".format(content_hash, size[0], size[1]))
+    if os.path.isfile(thumbnail_path):
+        return source_path, content_hash, thumbnail_path
+
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok = True)
+    #The thumbnail is written under a temporary name first, so a half-written file is never taken for a thumbnail.
+    temp_path = "{}.{}.tmp".format(thumbnail_path, os.getpid())
+    if os.path.splitext(source_path)[1].lower() == ".pdf":
+        created = render_pdf_thumbnail(source_path, temp_path, size)
+    else:
+        created = render_image_thumbnail(source_path, temp_path, size)
+
+    if not created:
+        return source_path, content_hash, None
+    os.replace(temp_path, thumbnail_path)
+    return source_path, content_hash, thumbnail_path
+
+
+def render_image_thumbnail(source_path, target_path, size):
+    #Imported here, so the module can be loaded without Qt, e.g. by scripts which only handle PDFs.
+    from PyQt5 import QtCore, QtGui
+
+    reader = QtGui.QImageReader(source_path)
+    original_size = reader.size()
+    target_size = QtCore.QSize(*size)
+    if original_size.isValid():
+        reader.setScaledSize(original_size.scaled(target_size, QtCore.Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return False
+    if not original_size.isValid():
+        image = image.scaled(target_size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+    return image.save(target_path, "PNG")
+
+
+def render_pdf_thumbnail(source_path, target_path, size):
+    if fitz is None:
+        return False
+    try:
+        with fitz.open(source_path) as document:
+            page = document[0]
+            zoom = min(size[0] / page.rect.width, size[1] / page.rect.height)
+            page.get_pixmap(matrix = fitz.Matrix(zoom, zoom)).save(target_path, "png")
+        return True
+    except (RuntimeError, ValueError, IndexError) as e:
+        print("No thumbnail for {}: {}".format(source_path, e))
+        return False
+
+
+class ThumbnailGenerator:
+    """
+    Generates fixed-size thumbnails for the sheets (or image media) of all tracks in a process pool and writes their
+    paths into tracks.thumbnail_location. Files whose size and mtime haven't changed since the last run are skipped,
+    including those no thumbnail could be generated from.
+    """
+
+    def __init__(self, db, thumbnail_directory = constants.THUMBNAIL_DIRECTORY, size = constants.THUMBNAIL_SIZE):
+        """
+        @param db: The TrackDbHandler of the database containing the tracks.
+        @param thumbnail_directory: The directory the thumbnails are stored in.
+        @param size: A tuple (width, height) the thumbnails are scaled to fit into.
+        """
+
+        self.db = db
+        self.thumbnail_directory = thumbnail_directory
+        self.size = tuple(size)
+        self.size_name = "{}x{}".format(*self.size)
+        self.db.create_table("thumbnail_cache", constants.THUMBNAIL_CACHE_COLS)
+        self.db.update_db_description()
+        if self.db.db_information["thumbnail_cache"] != [col[0] for col in constants.THUMBNAIL_CACHE_COLS]:
+            #Caches of older versions lack the thumbnail size, their rows are never matched and regenerated once.
+            self.db.alter_table("thumbnail_cache", constants.THUMBNAIL_CACHE_COLS)
+
+    def get_source(self, sheet_location, media_location):
+        """
+        Returns the file a track's thumbnail is generated from: the sheet, or the media if it is an image.
+        PDFs are only used if PyMuPDF is installed.
+        """
+
+        if sheet_location and os.path.splitext(sheet_location)[1].lower() in constants.THUMBNAIL_SOURCE_TYPES:
+            if fitz is not None or os.path.splitext(sheet_location)[1].lower() != ".pdf":
+                return sheet_location
+        if media_location and os.path.splitext(media_location)[1].lower() in constants.THUMBNAIL_IMAGE_TYPES:
+            return media_location
+        return None
+
+    def is_generated(self, thumbnail_location):
+        """
+        Checks if a thumbnail was created by the generator. Thumbnails set by hand are never overwritten.
+        """
+
+        if not thumbnail_location:
+            return True
+        return os.path.abspath(thumbnail_location).startswith(os.path.abspath(self.thumbnail_directory) + os.sep)
+
+    def update_thumbnails(self, max_workers = None, chunk_size = 16):
+        """
+        Generates the missing or outdated thumbnails and writes all changed locations back in one transaction.
+
+        @param max_workers: The amount of worker processes, per default one per core.
+        @param chunk_size: The amount of files handed out to a worker at once.
+        @return: A tuple containing the amount of generated (or reused) thumbnails and the amount of tracks updated.
+        """
+
+        cursor = self.db.db_connection.cursor()
+        with self.db.db_connection:
+            cursor.execute("SELECT source_path, size, mtime, thumbnail_path FROM thumbnail_cache "
+                           "WHERE thumbnail_size = ?", (self.size_name,))
+            cached = {row[0]: row[1:] for row in cursor.fetchall()}
+            cursor.execute("SELECT track_id, sheet_location, media_location, thumbnail_location FROM tracks "
+                           "WHERE sheet_location IS NOT NULL OR media_location IS NOT NULL")
+            tracks = cursor.fetchall()
+
+        #Tracks by source file, so a file shared by several tracks is only processed once.
+        sources = {}
+        stats = {}
+        thumbnails = {}
+        failed = set()
+        for track_id, sheet_location, media_location, thumbnail_location in tracks:
+            source = self.get_source(sheet_location, media_location)
+            if not source or not self.is_generated(thumbnail_location):
+                continue
+            sources.setdefault(source, []).append((track_id, thumbnail_location))
+            if source in stats:
+                continue
+            try:
+                stat = os.stat(source)
+            except OSError:
+                continue
+            stats[source] = (stat.st_size, stat.st_mtime)
+            if source in cached and cached[source][:2] == stats[source]:
+                if cached[source][2] is None:
+                    #No thumbnail could be generated from this version of the file.
+                    failed.add(source)
+                elif os.path.isfile(cached[source][2]):
+                    thumbnails[source] = cached[source][2]
+
+        outdated = [source for source in stats if source not in thumbnails and source not in failed]
+        cache_rows = []
+        if outdated:
+            with ProcessPoolExecutor(max_workers = max_workers) as executor:
+                results = executor.map(create_thumbnail, outdated, [self.thumbnail_directory] * len(outdated),
+                                       [self.size] * len(outdated), chunksize = chunk_size)
+                for source, content_hash, thumbnail_path in results:
+                    if thumbnail_path:
+                        thumbnails[source] = thumbnail_path
+                    cache_rows.append((source, stats[source][0], stats[source][1], content_hash, thumbnail_path,
+                                       self.size_name))
+
+        track_rows = []
+        for source, thumbnail_path in thumbnails.items():
+            for track_id, thumbnail_location in sources[source]:
+                if thumbnail_location != thumbnail_path:
+                    track_rows.append((thumbnail_path, track_id))
+
+        with self.db.transaction():
+            cursor.executemany("INSERT OR REPLACE INTO thumbnail_cache VALUES (?, ?, ?, ?, ?, ?)", cache_rows)
+            cursor.executemany("UPDATE tracks SET thumbnail_location = ? WHERE track_id = ?", track_rows)
+        return len([row for row in cache_rows if row[4]]), len(track_rows)
+
+
+if __name__ == "__main__":
+    import db_interface
+
+    generator = ThumbnailGenerator(db_interface.TrackDbHandler(constants.MAIN_DB_PATH))
+    print(generator.update_thumbnails())
@@ -64,5 +64,135 @@ COLLECTIONS_TRACKS_COLS = [("track_id",
                            ("collection_id",
                                     "INTEGER REFERENCES collections(collection_id) ON DELETE CASCADE ON UPDATE CASCADE")]
 
+#A track can only be added once to a collection. The key also serves the lookups by collection_id.
+COLLECTIONS_TRACKS_KEY = ["collection_id", "track_id"]
+COLLECTIONS_TRACKS_CONSTRAINTS = ["PRIMARY KEY ({})".format(", ".join(COLLECTIONS_TRACKS_KEY))]
+
+#The columns identifying a track. Two tracks with the same values (NULL included) in all these columns are duplicates.
+TRACKS_NATURAL_KEY = ["track_name", "year", "interpreter_id", "composer_id", "genre_id"]
+#The columns of 'tracks' referencing files, which are kept when duplicate tracks are merged
+TRACKS_LOCATION_COLS = ["media_location", "sheet_location", "thumbnail_location"]
+
 FOREIGN_KEYS = {"composer_id": "composer_name", "interpreter_id": "interpreter_name", "genre_id": "genre_name"}
-RELATIONS = {"tracks": ["composers", "interpreters", "genres"]}
\ No newline at end of file
+#The lookup tables the foreign keys in 'tracks' are referencing
+FOREIGN_KEY_TABLES = {"composer_id": "composers", "interpreter_id": "interpreters", "genre_id": "genres"}
+
+#The groups a collection is sorted into: (group name, lookup table, key column, name column)
+COLLECTION_GROUPS = [("Interpreten", "interpreters", "interpreter_id", "interpreter_name"),
+                     ("Komponisten", "composers", "composer_id", "composer_name"),
+                     ("Genres", "genres", "genre_id", "genre_name")]
+
+#The indexes created by TrackDbHandler: (index_name, table_name, columns, unique)
+INDEXES = [("tracks_track_name", "tracks", ["track_name"], False),
+           ("tracks_interpreter_id", "tracks", ["interpreter_id"], False),
+           ("tracks_composer_id", "tracks", ["composer_id"], False),
+           ("tracks_genre_id", "tracks", ["genre_id"], False),
+           ("tracks_media_location", "tracks", ["media_location"], False),
+           ("tracks_sheet_location", "tracks", ["sheet_location"], False),
+           ("collections_tracks_track_id", "collections_tracks", ["track_id"], False),
+           ("collections_collection_name", "collections", ["collection_name"], False),
+           ("interpreters_interpreter_name", "interpreters", ["interpreter_name"], True),
+           ("composers_composer_name", "composers", ["composer_name"], True),
+           ("genres_genre_name", "genres", ["genre_name"], True)]
+
+#The columns of the full-text search index 'tracks_search' and the columns of JOIN_COLS they are filled from.
+#The rowid of the index is the track_id.
+SEARCH_COLS = [("track_name", "tracks.track_name"),
+               ("year", "tracks.year"),
+               ("interpreter_name", "interpreters.interpreter_name"),
+               ("composer_name", "composers.composer_name"),
+               ("genre_name", "genres.genre_name")]
+
+#Frequently executed queries, which TrackDbHandler.check_query_plans() expects to be answered with indexes
+HOT_QUERIES = {"entries_by_track_id": "SELECT {} FROM {} WHERE tracks.track_id = ?".format(
+                                            ", ".join(ENTRY_COLS_SORTED), JOIN_COLS),
+               "entries_by_track_name": "SELECT {} FROM {} WHERE tracks.track_name = ?".format(
+                                            ", ".join(ENTRY_COLS_SORTED), JOIN_COLS),
+               "entries_by_interpreter": "SELECT {} FROM {} WHERE interpreters.interpreter_name = ?".format(
+                                            ", ".join(ENTRY_COLS_SORTED), JOIN_COLS),
+               "entries_by_composer": "SELECT {} FROM {} WHERE composers.composer_name = ?".format(
+                                            ", ".join(ENTRY_COLS_SORTED), JOIN_COLS),
+               "entries_by_genre": "SELECT {} FROM {} WHERE genres.genre_name = ?".format(
+                                            ", ".join(ENTRY_COLS_SORTED), JOIN_COLS),
+               "collection_tracks": "SELECT track_id FROM collections_tracks WHERE collection_id = ?",
+               "collection_membership": "SELECT * FROM collections_tracks WHERE track_id = ? AND collection_id = ?",
+               "collection_id": "SELECT collection_id FROM collections WHERE collection_name = ?",
+               "interpreter_id": "SELECT interpreter_id FROM interpreters WHERE interpreter_name = ?",
+               "composer_id": "SELECT composer_id FROM composers WHERE composer_name = ?",
+               "genre_id": "SELECT genre_id FROM genres WHERE genre_name = ?"}
+RELATIONS = {"tracks": ["composers", "interpreters", "genres"]}
+
+#The amount of seconds a connection waits for a lock held by another connection (see db_management/connection_pool.py)
+DB_BUSY_TIMEOUT = 30
+
+#The amount of sqlite VM instructions after which a running call of db_management/async_interface.py checks whether
+#it was cancelled. Smaller values stop cancelled calls sooner but slow down every statement.
+DB_CANCEL_CHECK_INTERVAL = 1000
+
+#Pragmas set on every new connection, by profile name (see db_management/connection_pool.py)
+#WAL with synchronous=NORMAL only syncs at checkpoints, a crash can lose the last commits but never corrupts the db.
+DB_PROFILES = {"default": [("journal_mode", "WAL"),
+                           ("synchronous", "NORMAL"),
+                           ("cache_size", -20000),
+                           ("mmap_size", 268435456),
+                           ("temp_store", "MEMORY")],
+               #Syncs on every commit, for data which must survive a power loss.
+               "durable": [("journal_mode", "WAL"),
+                           ("synchronous", "FULL"),
+                           ("cache_size", -20000),
+                           ("temp_store", "MEMORY")],
+               #The defaults of sqlite (rollback journal), used as baseline in benchmarks.py
+               "legacy": [("journal_mode", "DELETE"),
+                          ("synchronous", "FULL")]}
+DEFAULT_DB_PROFILE = "default"
+
+#The maximal amount of names cached per lookup table (see db_management/lookup_cache.py)
+LOOKUP_CACHE_SIZE = 10000
+
+#The size (width, height) thumbnails are scaled to and the memory the decoded thumbnails may use (see ui/thumbnails.py)
+THUMBNAIL_SIZE = (200, 200)
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+#The amount of seconds a cached thumbnail is shown before its file is checked for changes again
+THUMBNAIL_RECHECK_SECONDS = 30
+
+#The content-addressed directory generated thumbnails are stored in (see db_management/thumbnail_generator.py)
+THUMBNAIL_DIRECTORY = os.path.join(DATA_ROOT_DIRECTORY, "thumbnails")
+#File types thumbnails can be generated from. PDFs need the optional package PyMuPDF.
+THUMBNAIL_IMAGE_TYPES = [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff"]
+THUMBNAIL_SOURCE_TYPES = THUMBNAIL_IMAGE_TYPES + [".pdf"]
+
+#Remembers which file a thumbnail was generated from, so unchanged files are skipped. The thumbnail_path of a file
+#no thumbnail could be generated from is NULL, so it isn't retried until it changes.
+THUMBNAIL_CACHE_COLS = [("source_path", "TEXT PRIMARY KEY"),
+                        ("size", "INTEGER"),
+                        ("mtime", "REAL"),
+                        ("content_hash", "TEXT"),
+                        ("thumbnail_path", "TEXT"),
+                        ("thumbnail_size", "TEXT")]
+#The media and sheet files indexed by the library scanner (see db_management/library_indexer.py)
+LIBRARY_AUDIO_TYPES = [".mp3", ".flac", ".ogg", ".opus", ".wav", ".m4a", ".aac", ".wma", ".mid", ".midi"]
+LIBRARY_VIDEO_TYPES = [".mp4", ".mkv", ".webm", ".avi", ".mov"]
+LIBRARY_SHEET_TYPES = THUMBNAIL_SOURCE_TYPES + [".musicxml", ".mxl", ".mscz", ".gp", ".gp5", ".gpx"]
+LIBRARY_FILE_TYPES = LIBRARY_AUDIO_TYPES + LIBRARY_VIDEO_TYPES + LIBRARY_SHEET_TYPES
+#Directories inside DATA_ROOT_DIRECTORY which are never indexed
+LIBRARY_EXCLUDED_DIRECTORIES = [THUMBNAIL_DIRECTORY]
+
+#Every file found by the library scanner, by path. present is 0 for files which disappeared since they were indexed.
+FILE_INDEX_COLS = [("path", "TEXT PRIMARY KEY"),
+                   ("size", "INTEGER"),
+                   ("mtime", "REAL"),
+                   ("content_hash", "TEXT"),
+                   ("present", "INTEGER")]
+
+#Snapshots and the content-addressed chunks of the backed up files (see db_management/backup_handler.py)
+BACKUP_DIRECTORY = os.path.join(os.path.expanduser("~"), APPLICATION_NAME + "_backups")
+#Files are split into chunks of this size, so a file which only grew at its end shares its first chunks
+BACKUP_CHUNK_SIZE = 4 * 1024 * 1024
+
+#The position an import has reached in a source file, so an interrupted import can resume (see db_management/importer.py)
+IMPORT_CHECKPOINT_COLS = [("source_path", "TEXT PRIMARY KEY"),
+                          ("size", "INTEGER"),
+                          ("mtime", "REAL"),
+                          ("position", "INTEGER"),
+                          ("inserted", "INTEGER"),
+                          ("skipped", "INTEGER")]
@@ -43,10 +43,50 @@ class LinkingHandler():
             root = self.root
         return os.walk(root)
 
+    def get_files(self, root = None, extensions = None, excluded = ()):
+        """
+        Walks through root like get_walk(), but yields the files together with their stat.
+        Uses os.scandir, which reads the file types along with the names, so only the files need a stat.
+
+        @param root: The directory to walk through, per default the data root directory.
+        @param extensions: A list of lowercase file extensions such as ".pdf". All files are yielded if it is None.
+        @param excluded: Directories which are skipped together with their contents.
+        @return: A generator yielding tuples containing the absolute path, the size and the mtime of every file.
+        """
+
+        if not root:
+            root = self.root
+        excluded = set(os.path.abspath(directory) for directory in excluded)
+        directories = [os.path.abspath(root)]
+        while directories:
+            directory = directories.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                print("{} couldn't be read: {}".format(directory, e))
+                continue
+            for entry in entries:
+                try:
+                    #Symlinked directories aren't followed, so links pointing upwards can't cause endless loops.
+                    if entry.is_dir(follow_symlinks = False):
+                        if entry.path not in excluded:
+                            directories.append(entry.path)
+                    elif entry.is_file():
+                        if extensions is None or os.path.splitext(entry.name)[1].lower() in extensions:
+                            stat = entry.stat()
+                            yield entry.path, stat.st_size, stat.st_mtime
+                except OSError:
+                    #The file disappeared while walking.
+                    continue
+
     def archive_data(self, name=None, format="zip"):
+        """
+        Archives the whole data directory at once. See db_management/backup_handler.py for incremental backups.
+        """
+
         if not name:
             name = self.root+"_bak"
-        shutil.make_archive(name,format, self.data_dir)
+        shutil.make_archive(name,format, self.root)
 
 if __name__ == "__main__":
     test = LinkingHandler()
@@ -1,4 +1,5 @@
 __author__ = 'eugde'
+import hashlib
 
 
 def contains(source_list,search_list):
@@ -30,4 +31,28 @@ def nonesort(entry):
 
 def create_placeholders(len):
     result = "( " + "?,"*(len-1) + "?)"
-    return result
\ No newline at end of file
+    return result
+
+def create_fts_query(text):
+    """
+    Turns user input such as 'villa lob' into a FTS5-query matching all rows containing every word as prefix.
+    Each word is quoted, so characters like '-' or '*' in the input can't be misread as FTS5-syntax.
+    """
+
+    terms = []
+    for word in text.split():
+        word = word.replace('"', '')
+        if word:
+            terms.append('"{}"*'.format(word))
+    return " ".join(terms)
+
+def hash_file(path, chunk_size = 1024 * 1024):
+    """
+    Returns the SHA-256 hex digest of a file's content. The file is read in chunks, so its size doesn't matter.
+    """
+
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
@@ -29,3 +29,14 @@ class InvalidColumnError(MyExeceptionBase):
         self.detail_info = "The following columns exist: "
         for columns in existing_columns:
             self.detail_info += ", ".join(columns) + "\n"
+
+class MissingSnapshotError(MyExeceptionBase):
+    def __init__(self, snapshot, path = None):
+        if path:
+            self.message = "The snapshot {} doesn't contain {}".format(snapshot, path)
+        else:
+            self.message = "The snapshot {} doesn't exist".format(snapshot)
+
+class CorruptedBackupError(MyExeceptionBase):
+    def __init__(self, chunk_hash):
+        self.message = "The backup chunk {} is missing or damaged".format(chunk_hash)
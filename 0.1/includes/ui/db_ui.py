@@ -2,49 +2,131 @@
 from PyQt5 import QtCore, QtWidgets, QtGui, uic
 import os, sys
 import math
+from collections import OrderedDict
 
-import db_interface
-import collection_interface, entry_dialog
-from misc import helper_functions, constants
+import db_interface, db_session
+import collection_interface, entry_dialog, thumbnails
+from misc import constants
 
 
 class DbModel(QtCore.QAbstractTableModel):
-    def __init__(self, db, parent=None):
+    def __init__(self, db, parent=None, chunk_size = 200, max_chunks = 10):
+        """
+        A windowed model of one database table. Rows are made known to the view chunk by chunk via
+        canFetchMore/fetchMore while it scrolls, and their data is read from sqlite on demand.
+        At most max_chunks chunks of chunk_size rows are held in memory, regardless of the size of the table.
+        """
+
         super(DbModel, self).__init__(parent)
-        self.data = []
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        #Cached chunks of rows by chunk number, the least recently used chunk first.
+        self.chunks = OrderedDict()
         self.columns = []
         self.visible_columns = []
         self.db = db
+        self.table_name = None
+        self.condition = []
+        self.condition_operator = "AND"
+        self.total_rows = 0
+        self.loaded_rows = 0
+        #The column the rows are sorted by inside the database, None keeps the order of insertion.
+        self.order_by = None
+        self.descending = False
         self.fetch_data("test")
 
     def fetch_data(self, table_name, columns = [], condition = [], condition_operator = "AND", dict_output = False):
-        self.data = self.db.fetch_table(table_name, columns, condition, condition_operator, dict_output)
-        self.columns = self.db.fetch_table_description(table_name)
+        """
+        Shows another table (or a part of it). Only the header and the amount of rows are read here.
+        """
+
+        self.beginResetModel()
+        self.table_name = table_name
+        self.columns = columns or self.db.fetch_table_description(table_name)
+        self.condition = condition
+        self.condition_operator = condition_operator
+        if self.order_by not in self.columns:
+            self.order_by = None
+        self.chunks.clear()
+        self.total_rows = self.db.count_rows(table_name, condition, condition_operator) if self.columns else 0
+        self.loaded_rows = min(self.total_rows, self.chunk_size)
+        self.endResetModel()
+
+    def fetch_chunk(self, chunk):
+        """
+        Returns the rows of one chunk, reading it from the database if it isn't cached.
+        """
+
+        if chunk in self.chunks:
+            self.chunks.move_to_end(chunk)
+            return self.chunks[chunk]
+
+        rows = self.db.fetch_table(self.table_name, self.columns, self.condition, self.condition_operator,
+                                   order_by = self.order_by, descending = self.descending,
+                                   limit = self.chunk_size, offset = chunk * self.chunk_size) or []
+        self.chunks[chunk] = rows
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last = False)
+        return rows
+
+    def canFetchMore(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.loaded_rows < self.total_rows
+
+    def fetchMore(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+        new_rows = min(self.total_rows - self.loaded_rows, self.chunk_size)
+        if new_rows <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self.loaded_rows, self.loaded_rows + new_rows - 1)
+        self.loaded_rows += new_rows
+        self.endInsertRows()
 
     def rowCount(self, parent = QtCore.QModelIndex()):
-        if self.data:
-            return len(self.data)
-        else:
+        if parent.isValid():
             return 0
+        return self.loaded_rows
 
     def columnCount(self, parent = QtCore.QModelIndex()):
-
-        if self.data:
-            return max([x for x in map(len, self.data)])
-        else:
+        if parent.isValid():
             return 0
+        return len(self.columns)
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
-        return [self.data[index.row()][index.column()], self.columns[index.column()]]
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+
+        chunk, row = divmod(index.row(), self.chunk_size)
+        rows = self.fetch_chunk(chunk)
+        if row >= len(rows):
+            return None
+        return [rows[row][index.column()], self.columns[index.column()]]
 
-    def headerData(self, col, orientation, role=QtCore.Qt.EditRole):
-        if orientation == QtCore.Qt.Horizontal:
+    def headerData(self, col, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
             return QtCore.QVariant(self.columns[col])
 
     def sort(self, col, sortOrder=QtCore.Qt.AscendingOrder):
+        """
+        Sorts the rows inside the database with ORDER BY, columns with an index are read straight from it.
+        NOTE: For a column without an index every chunk read sorts the whole table again (ORDER BY ... LIMIT/OFFSET)
+        on the GUI thread, which gets slow for large tables.
+        Sqlite sorts NULL before every other value, i.e. first ascending and last descending.
+        Only the cached windows are dropped, the views re-read the visible rows afterwards.
+        The model doesn't know where the rows end up, so persistent indexes such as the selection are invalidated.
+        """
+
+        if not self.columns:
+            return
         self.layoutAboutToBeChanged.emit()
-        self.data = sorted(self.data, key=lambda row: helper_functions.nonesort(row[col]), reverse=sortOrder)
-        self.modelReset.emit()
+        self.order_by = self.columns[col]
+        self.descending = sortOrder == QtCore.Qt.DescendingOrder
+        self.chunks.clear()
+        persistent_indexes = self.persistentIndexList()
+        self.changePersistentIndexList(persistent_indexes, [QtCore.QModelIndex()] * len(persistent_indexes))
+        self.layoutChanged.emit()
 
     def flags(self, index):
         return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsDragEnabled
@@ -61,6 +143,10 @@ class DbDelegate(QtWidgets.QItemDelegate):
 
         painter.setFont(self.mainFont)
         data = index.data()
+        if data is None:
+            #The row vanished from the database since the model counted the rows of the table.
+            painter.restore()
+            return
         try:
             painter.drawText(option.rect, QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter, data[0])
         except TypeError:
@@ -70,7 +156,7 @@ class DbDelegate(QtWidgets.QItemDelegate):
 
 
 class DbView(QtWidgets.QTableView):
-    def __init__(self, parent=None, db=db_interface.TrackDbHandler):
+    def __init__(self, parent=None, db=None):
         super(DbView, self).__init__(parent)
 
         self.setSortingEnabled(True)
@@ -78,7 +164,7 @@ class DbView(QtWidgets.QTableView):
 
         self.delegate = DbDelegate()
         self.setItemDelegate(self.delegate)
-        self.db = db
+        self.db = db if db is not None else db_session.get_db()
         self.setModel(DbModel(self.db))
         self.columns = self.model().columns
 
@@ -89,30 +175,52 @@ class DbView(QtWidgets.QTableView):
 
 
 class CollectionModel(QtCore.QAbstractItemModel):
-    def __init__(self, db = db_interface.TrackDbHandler(constants.MAIN_DB_PATH), parent = None):
+    def __init__(self, db = None, parent = None):
+        """
+        A tree of all collections and their groups. Only the collection names are loaded up front,
+        the groups of a collection are fetched when its node is expanded for the first time.
+        """
+
         super(CollectionModel, self).__init__(parent)
 
-        self.db = db
+        self.db = db if db is not None else db_session.get_db()
         self.root = TreeItem("Sammlungen")
+        #[name, collection_id] of every collection. Not named 'data' so it doesn't hide QAbstractItemModel.data().
         self.collections = []
-        self.data = []
+        #CollectionHandlers by collection_id, created when a collection is expanded.
+        self.handlers = {}
         self.get_all_collections()
 
     def get_all_collections(self):
+        """
+        Loads the names and ids of all collections with a single query.
+        """
 
-        del self.data[:]
-        sql = "SELECT collection_name FROM collections"
+        cursor = self.db.db_connection.cursor()
+        self.beginResetModel()
+        del self.collections[:]
+        self.handlers.clear()
+        self.root.children = []
+        sql = "SELECT collection_id, collection_name FROM collections ORDER BY collection_name"
         with self.db.db_connection:
-            self.db.cursor.execute(sql)
-            for collection in self.db.cursor.fetchall():
-                col_name = collection[0]
-                col_handler = collection_interface.CollectionHandler(col_name, self.db)
-                self.data.append([col_name, col_handler])
-                self.root.add_child(TreeItem(col_name))
-
-    def get_collection_members(self, parent, collection):
-        col_handler = collection[1]
-        categories = col_handler.update_groups()
+            cursor.execute(sql)
+            for col_id, col_name in cursor.fetchall():
+                self.collections.append([col_name, col_id])
+                self.root.add_child(TreeItem(col_name, collection_id = col_id))
+        self.endResetModel()
+
+    def get_collection_handler(self, col_name, col_id):
+        if col_id not in self.handlers:
+            self.handlers[col_id] = collection_interface.CollectionHandler(col_name, self.db, col_id)
+        return self.handlers[col_id]
+
+    def get_collection_members(self, parent):
+        """
+        Adds the groups of a collection and their members as children to the collection's TreeItem.
+        """
+
+        col_handler = self.get_collection_handler(parent.name, parent.collection_id)
+        categories = col_handler.groups
         for group in categories:
             group_item = TreeItem(group)
             parent.add_child(group_item)
@@ -121,20 +229,46 @@ class CollectionModel(QtCore.QAbstractItemModel):
                 for entry in categories[group]:
                     entry_item = TreeItem(entry)
                     group_item.add_child(entry_item)
+        parent.fetched = True
+
+    def hasChildren(self, parent = QtCore.QModelIndex()):
+        item = parent.internalPointer() if parent.isValid() else self.root
+        return not item.fetched or item.children_count() > 0
+
+    def canFetchMore(self, parent):
+        if not parent.isValid():
+            return False
+        return not parent.internalPointer().fetched
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        item = parent.internalPointer()
+        groups_amount = len(constants.COLLECTION_GROUPS)
+        self.beginInsertRows(parent, 0, groups_amount - 1)
+        self.get_collection_members(item)
+        self.endInsertRows()
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        item = parent.internalPointer() if parent.isValid() else self.root
+        return item.children_count()
 
-    def columnCount(self, index):
+    def columnCount(self, index = QtCore.QModelIndex()):
         if index.isValid():
             return index.internalPointer().columnCount()
+        return self.root.columnCount()
 
-    def data(self, index, role):
-        if not index.isValid():
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
             return None
 
         item = index.internalPointer()
 
         return item.data()
 
-    def index(self, row, column, parent):
+    def index(self, row, column, parent = QtCore.QModelIndex()):
         if not self.hasIndex(row, column, parent):
             return QtCore.QModelIndex()
 
@@ -149,13 +283,24 @@ class CollectionModel(QtCore.QAbstractItemModel):
         else:
             return QtCore.QModelIndex()
 
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        parentItem = index.internalPointer().parent
+        if parentItem is None or parentItem is self.root:
+            return QtCore.QModelIndex()
+        return self.createIndex(parentItem.row(), 0, parentItem)
 
 
 class TreeItem:
-    def __init__(self, name, parent = None):
+    def __init__(self, name, parent = None, collection_id = None):
         self.name = name
         self.children = []
         self.parent = parent
+        #Only collection-items have an id. Their children are loaded on demand, so they start out unfetched.
+        self.collection_id = collection_id
+        self.fetched = collection_id is None
 
     def __del__(self):
         for child in self.children:
@@ -163,7 +308,7 @@ class TreeItem:
 
     def row(self):
         if self.parent:
-            return self.parent.children.index(self.name)
+            return self.parent.children.index(self)
         else:
             return 0
 
@@ -208,17 +353,20 @@ class TreeItem:
 
 
 class CollectionView(QtWidgets.QTreeView):
-    def __init__(self, db = db_interface.TrackDbHandler(constants.MAIN_DB_PATH), parent = None):
+    def __init__(self, db = None, parent = None):
         super(CollectionView, self).__init__(parent)
 
-        self.db = db
+        self.db = db if db is not None else db_session.get_db()
         self.setModel(CollectionModel(db))
 
 
-class EntryTabView(QtWidgets.QTabWidget):
+class EntryTabView(QtWidgets.QWidget):
     def __init__(self, entries = None, widgets_per_page = 8, parent = None):
         """
-        This TabWidget shows a collection of EntryView-Widgets on base of the entries passed to it.
+        This widget shows a collection of EntryView-Widgets on base of the entries passed to it, split into pages
+        which are selected with tabs.
+        The tabs are plain labels. There is only one EntryTabPage, which is filled with the entries of the selected
+        page when it is shown, so only the EntryViews of one page exist no matter how many entries there are.
 
         @param entries: A list of members of the Entry-class, containing the data to be displayed.
         """
@@ -226,63 +374,112 @@ class EntryTabView(QtWidgets.QTabWidget):
         super(EntryTabView, self).__init__(parent)
         self.widgets_per_page = widgets_per_page
         self.pages_amount = 0
-        self.set_entries(entries, widgets_per_page)
-        self.setTabPosition(QtWidgets.QTabWidget.South)
-        self.setTabShape(QtWidgets.QTabWidget.Triangular)
+        self.entries = []
+
+        self.tab_bar = QtWidgets.QTabBar(self)
+        self.tab_bar.setShape(QtWidgets.QTabBar.TriangularSouth)
+        self.tab_bar.setUsesScrollButtons(True)
+        self.page = EntryTabPage([], col_count = 4, row_count = math.ceil(widgets_per_page/4), parent = self)
 
+        self.setLayout(QtWidgets.QVBoxLayout(self))
+        self.layout().addWidget(self.page, 10)
+        self.layout().addWidget(self.tab_bar)
 
+        self.tab_bar.currentChanged.connect(self.show_page)
+        self.set_entries(entries, widgets_per_page)
 
     def set_entries(self, entries, widgets_per_page = None):
-        if not widgets_per_page:
-            widgets_per_page = self.widgets_per_page
+        if widgets_per_page and widgets_per_page != self.widgets_per_page:
+            self.widgets_per_page = widgets_per_page
+            self.page.set_grid(math.ceil(widgets_per_page/4), 4)
 
-        if entries:
-            self.pages_amount = math.ceil(len(entries)/widgets_per_page)
-        self.clear()
+        #Only a reference to the list is kept, the entries of a page are sliced out when it is shown.
+        self.entries = entries or []
+        self.pages_amount = math.ceil(len(self.entries)/self.widgets_per_page)
 
+        self.tab_bar.blockSignals(True)
+        while self.tab_bar.count():
+            self.tab_bar.removeTab(self.tab_bar.count() - 1)
         for page in range(0,self.pages_amount):
-            self.addTab(EntryTabPage(entries[:(widgets_per_page-1)], parent = self), "Seite {}".format(page+1))
-            entries = entries[widgets_per_page:]
+            self.tab_bar.addTab("Seite {}".format(page+1))
+        self.tab_bar.blockSignals(False)
+
+        self.show_page(0)
 
+    def show_page(self, page):
+        start = page * self.widgets_per_page
+        self.page.set_entries(self.entries[start:start + self.widgets_per_page])
         self.update()
 
 
 class EntryTabPage(QtWidgets.QWidget):
     def __init__(self, entries, row_count = 2, col_count=4, parent = None):
+        """
+        A grid of EntryViews. The EntryViews are reused when other entries are shown.
+        """
+
         super(EntryTabPage,self).__init__(parent)
 
         self.setLayout(QtWidgets.QGridLayout(self))
-
-        for row in range(0,row_count):
-            for col in range(0, col_count):
-                try:
-                    widget = EntryView(entries[col], parent = self)
-                    self.layout().addWidget(widget, row, col)
-                except IndexError:
-                    self.layout().addItem(QtWidgets.QSpacerItem(1,1,QtWidgets.QSizePolicy.Ignored),row,col)
+        self.views = []
+        self.set_grid(row_count, col_count)
+        self.set_entries(entries)
+
+    def set_grid(self, row_count, col_count):
+        for view in self.views:
+            self.layout().removeWidget(view)
+            view.deleteLater()
+        self.views = []
+        self.row_count = row_count
+        self.col_count = col_count
+
+    def set_entries(self, entries):
+        for position, entry in enumerate(entries[:self.row_count*self.col_count]):
+            if position < len(self.views):
+                self.views[position].set_entry(entry)
+            else:
+                view = EntryView(entry, parent = self)
+                size_policy = view.sizePolicy()
+                size_policy.setRetainSizeWhenHidden(True)
+                view.setSizePolicy(size_policy)
+                self.views.append(view)
+                self.layout().addWidget(view, position // self.col_count, position % self.col_count)
+            self.views[position].show()
+
+        #Views which aren't needed on this page are hidden but keep their place in the grid.
+        for view in self.views[len(entries):]:
+            view.hide()
 
 
 class EntryView(QtWidgets.QWidget):
-    def __init__(self, entry, db = db_interface.TrackDbHandler(constants.MAIN_DB_PATH), parent = None):
+    def __init__(self, entry, db = None, parent = None):
         super(EntryView, self).__init__(parent)
 
         self.entry = entry
         self.data = []
 
-        self.db = db
+        self.db = db if db is not None else db_session.get_db()
 
         self.sizeRect = self.rect().adjusted(10,10, -10,-10)
 
         self.name = ""
         self.interpreter = ""
         self.thumbnail_location = ""
+        self.thumbnail_size = QtCore.QSize(*constants.THUMBNAIL_SIZE)
         self.thumbnail = QtGui.QImage()
+        self.thumbnailRect = QtCore.QRect()
+        self.thumbnails = thumbnails.get_thumbnail_service()
+        self.thumbnails.thumbnail_ready.connect(self.set_thumbnail)
         self.update_render_data()
 
 
         self.inFocus = False
 
-        self.thumbnailRect = QtCore.QRect(0,0,self.thumbnail.width(), self.thumbnail.height())
+    def set_entry(self, entry):
+        self.entry = entry
+        self.inFocus = False
+        self.update_render_data()
+        self.update()
 
     def update_entry(self):
         self.entry = self.db.get_entries(con_table = "tracks", con_col = "track_id",
@@ -293,11 +490,20 @@ class EntryView(QtWidgets.QWidget):
         self.name = self.entry.data[1][1]
         self.interpreter = self.entry.data[2][1]
         self.thumbnail_location = self.entry.data[8][1]
-        if os.path.isfile(self.thumbnail_location):
-            self.thumbnail.load(self.thumbnail_location)
-        else:
-            self.thumbnail.load(os.path.join("data","img", "placeholder.png"))
-            print()
+        #The image is decoded in the background, until then the placeholder is shown.
+        image = self.thumbnails.request(self.thumbnail_location, self.thumbnail_size)
+        if image is None:
+            image = self.thumbnails.placeholder(self.thumbnail_size)
+        self.set_image(image)
+
+    def set_thumbnail(self, path, size, image):
+        if path == self.thumbnail_location and size == self.thumbnail_size:
+            self.set_image(image)
+            self.update()
+
+    def set_image(self, image):
+        self.thumbnail = image
+        self.thumbnailRect = QtCore.QRect(0,0,self.thumbnail.width(), self.thumbnail.height())
 
     def enterEvent(self, event):
         self.inFocus = True
@@ -309,7 +515,7 @@ class EntryView(QtWidgets.QWidget):
         self.update()
 
     def mouseDoubleClickEvent(self, event):
-        entryDialog = entry_dialog.EntryDialog(self.entry, parent = self)
+        entryDialog = entry_dialog.EntryDialog(self.entry, db = self.db, parent = self)
         entryDialog.show()
 
 
@@ -320,8 +526,11 @@ class EntryView(QtWidgets.QWidget):
         painter.setBrush(QtGui.QBrush(QtGui.QColor(255,255,255)))
 
         painter.drawRoundedRect(self.sizeRect.adjusted(-5,-5,10,10), 20,15)
-        #TODO: Fix scaling!
-        painter.drawImage(self.sizeRect, self.thumbnail, self.thumbnailRect)
+        #The thumbnail is fitted into the widget keeping its aspect ratio and centered, instead of being stretched.
+        target_size = self.thumbnailRect.size().scaled(self.sizeRect.size(), QtCore.Qt.KeepAspectRatio)
+        target_rect = QtCore.QRect(QtCore.QPoint(0, 0), target_size)
+        target_rect.moveCenter(self.sizeRect.center())
+        painter.drawImage(target_rect, self.thumbnail, self.thumbnailRect)
 
         painter.drawText(self.sizeRect.adjusted(5,5,-10,-10), QtCore.Qt.AlignLeft | QtCore.Qt.AlignBottom,
                             self.name+":\n"+self.interpreter)
@@ -346,6 +555,6 @@ if __name__ == "__main__":
     test_v.update()
     test_v.show()
     test = CollectionModel()
-    print(test.data)
-    print(test.get_collection_members(test.root.children[0], test.data[0]))
+    print(test.collections)
+    print(test.get_collection_members(test.root.children[0]))
     sys.exit(app.exec_())
\ No newline at end of file
@@ -4,16 +4,16 @@ import sys
 
 from PyQt5 import QtCore, QtWidgets, QtGui, uic
 
-import db_interface, constants
+import db_interface, db_session, constants, thumbnails
 
 
 class EntryDialog(QtWidgets.QDialog):
-    def __init__(self, entry, db = db_interface.TrackDbHandler(constants.MAIN_DB_PATH), parent=None):
+    def __init__(self, entry, db = None, parent=None):
         super(EntryDialog, self).__init__(parent)
         self.ui = uic.loadUi(os.path.join("data", "dialog", "view_dialog.ui"), self)
         self.entry = entry
         self.entry_id = self.entry.get_track_id()
-        self.db = db
+        self.db = db if db is not None else db_session.get_db()
 
         self.ui_lines = []
         for line in self.entry.data[1:]:
@@ -41,15 +41,22 @@ class EntryDialog(QtWidgets.QDialog):
             print(x)
             i += 1
 
-        if os.path.isfile(entry.data[8][1]):
-            self.thumbnail_path = entry.data[8][1]
-        else:
-            self.thumbnail_path = (os.path.join("data","img", "placeholder.png"))
-
-        self.ui.imageLabel.setPixmap(QtGui.QPixmap(self.thumbnail_path))
+        #The thumbnail is shared with the EntryViews and decoded in the background if it isn't cached yet.
+        self.thumbnail_path = entry.data[8][1]
+        self.thumbnail_size = QtCore.QSize(*constants.THUMBNAIL_SIZE)
+        self.thumbnails = thumbnails.get_thumbnail_service()
+        self.thumbnails.thumbnail_ready.connect(self.set_thumbnail)
+        image = self.thumbnails.request(self.thumbnail_path, self.thumbnail_size)
+        if image is None:
+            image = self.thumbnails.placeholder(self.thumbnail_size)
+        self.ui.imageLabel.setPixmap(QtGui.QPixmap.fromImage(image))
         self.ui.choiceButtons.accepted.connect(self.save_data)
         self.ui.choiceButtons.rejected.connect(self.close)
 
+    def set_thumbnail(self, path, size, image):
+        if path == self.thumbnail_path and size == self.thumbnail_size:
+            self.ui.imageLabel.setPixmap(QtGui.QPixmap.fromImage(image))
+
     #TODO: Update this
     def save_data(self):
         data_tbs = [self.entry.get_track_id()]
@@ -57,7 +64,7 @@ class EntryDialog(QtWidgets.QDialog):
             data_tbs.append((line.get_content()))
         #self.db.update_table("test", data_tbs, [("id =", self.entry_id)])
         print(data_tbs)
-        self.entry.save_data(self.db, data_tbs)
+        self.entry = self.entry.save_data(self.db, data_tbs)
         self.parent().update_entry()
         self.close()
 
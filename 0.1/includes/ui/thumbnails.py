@@ -0,0 +1,201 @@
+from PyQt5 import QtCore, QtGui
+from collections import OrderedDict
+import os
+import time
+
+from misc import constants
+
+
+PLACEHOLDER_PATH = os.path.join("data", "img", "placeholder.png")
+
+
+class ThumbnailService(QtCore.QObject):
+    """
+    Loads thumbnails on a pool of worker threads and keeps the scaled images in a memory-bounded LRU-cache.
+    Widgets request an image with request() and connect to thumbnail_ready to be notified when it has arrived.
+    Files of cached images are checked for changes on a worker thread every constants.THUMBNAIL_RECHECK_SECONDS.
+    A changed file is loaded again and thumbnail_ready is emitted with its new image.
+    """
+
+    #path, target size, scaled image
+    thumbnail_ready = QtCore.pyqtSignal(str, QtCore.QSize, QtGui.QImage)
+    #Emitted by the worker threads, delivered in the thread of the service (queued connection).
+    image_decoded = QtCore.pyqtSignal(str, float, QtCore.QSize, QtGui.QImage)
+    #path, current mtime (0.0 if the file is gone), emitted by the worker threads as well
+    file_checked = QtCore.pyqtSignal(str, float)
+
+    def __init__(self, max_bytes = constants.THUMBNAIL_CACHE_BYTES, max_threads = 4,
+                 recheck_seconds = constants.THUMBNAIL_RECHECK_SECONDS, parent = None):
+        """
+        @param max_bytes: The maximal amount of memory used by the cached images.
+        @param max_threads: The amount of threads decoding images in parallel.
+        @param recheck_seconds: The amount of seconds after which the file of a cached image is checked again.
+        """
+
+        super(ThumbnailService, self).__init__(parent)
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        #Scaled images by (path, mtime, width, height), the least recently used image first.
+        self.cache = OrderedDict()
+        #The modification time of every loaded file, so the cache can be used without a stat on the GUI thread.
+        self.mtimes = {}
+        #The time.monotonic() of the last stat of every loaded file.
+        self.checked = {}
+        self.recheck_seconds = recheck_seconds
+        #Files currently checked by a worker.
+        self.checking = set()
+        #Requests waiting for a worker, by (path, width, height).
+        self.pending = set()
+        self.placeholders = {}
+        self.placeholder_image = QtGui.QImage(PLACEHOLDER_PATH)
+
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.image_decoded.connect(self.store_image)
+        self.file_checked.connect(self.check_file)
+
+    def request(self, path, size):
+        """
+        Returns the cached thumbnail of path scaled to fit into size, or None if it has to be loaded first.
+        In that case thumbnail_ready is emitted as soon as the image has been decoded.
+
+        @param path: The path of the image file. Files which don't exist are shown as placeholder.
+        @param size: A QSize the image is scaled to, keeping its aspect ratio.
+        """
+
+        if not path:
+            return self.placeholder(size)
+
+        if path in self.mtimes:
+            key = (path, self.mtimes[path], size.width(), size.height())
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                if time.monotonic() - self.checked[path] > self.recheck_seconds and path not in self.checking:
+                    self.checking.add(path)
+                    self.pool.start(StatTask(self, path))
+                return self.cache[key]
+
+        request_key = (path, size.width(), size.height())
+        if request_key not in self.pending:
+            self.pending.add(request_key)
+            self.pool.start(ThumbnailTask(self, path, size))
+        return None
+
+    def invalidate(self, path):
+        """
+        Drops all cached thumbnails of path, e.g. after the file was changed.
+        """
+
+        self.mtimes.pop(path, None)
+        self.checked.pop(path, None)
+        for key in [key for key in self.cache if key[0] == path]:
+            self.used_bytes -= self.cache.pop(key).byteCount()
+
+    def placeholder(self, size):
+        """
+        Returns the placeholder image scaled to size. The placeholder is decoded only once.
+        """
+
+        key = (size.width(), size.height())
+        if key not in self.placeholders:
+            self.placeholders[key] = self.placeholder_image.scaled(size, QtCore.Qt.KeepAspectRatio,
+                                                                   QtCore.Qt.SmoothTransformation)
+        return self.placeholders[key]
+
+    def store_image(self, path, mtime, size, image):
+        self.pending.discard((path, size.width(), size.height()))
+        if image.isNull():
+            #Missing or unreadable files are shown as placeholder but not cached, so they are retried later.
+            self.thumbnail_ready.emit(path, size, self.placeholder(size))
+            return
+
+        if self.mtimes.get(path) != mtime:
+            self.invalidate(path)
+            self.mtimes[path] = mtime
+        self.checked[path] = time.monotonic()
+
+        key = (path, mtime, size.width(), size.height())
+        if key not in self.cache:
+            self.cache[key] = image
+            self.used_bytes += image.byteCount()
+            while self.used_bytes > self.max_bytes and len(self.cache) > 1:
+                self.used_bytes -= self.cache.popitem(last = False)[1].byteCount()
+        self.thumbnail_ready.emit(path, size, image)
+
+    def check_file(self, path, mtime):
+        """
+        Reloads all cached sizes of path if the file was changed or removed since it was loaded.
+        """
+
+        self.checking.discard(path)
+        if path not in self.mtimes:
+            return
+        if self.mtimes[path] == mtime:
+            self.checked[path] = time.monotonic()
+            return
+
+        sizes = [QtCore.QSize(key[2], key[3]) for key in self.cache if key[0] == path]
+        self.invalidate(path)
+        for size in sizes:
+            self.request(path, size)
+
+
+class StatTask(QtCore.QRunnable):
+    """
+    Reads the modification time of a cached file on a worker thread, so the GUI thread never waits for the disk.
+    """
+
+    def __init__(self, service, path):
+        super(StatTask, self).__init__()
+        self.service = service
+        self.path = path
+
+    def run(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = 0.0
+        self.service.file_checked.emit(self.path, mtime)
+
+
+class ThumbnailTask(QtCore.QRunnable):
+    """
+    Decodes one image on a worker thread. QImage, unlike QPixmap, may be used outside of the GUI thread.
+    """
+
+    def __init__(self, service, path, size):
+        super(ThumbnailTask, self).__init__()
+        self.service = service
+        self.path = path
+        self.size = QtCore.QSize(size)
+
+    def run(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self.service.image_decoded.emit(self.path, 0.0, self.size, QtGui.QImage())
+            return
+
+        reader = QtGui.QImageReader(self.path)
+        original_size = reader.size()
+        if original_size.isValid():
+            #Letting the reader scale saves decoding the full resolution for formats such as JPEG.
+            reader.setScaledSize(original_size.scaled(self.size, QtCore.Qt.KeepAspectRatio))
+        image = reader.read()
+        if not image.isNull() and not original_size.isValid():
+            image = image.scaled(self.size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        self.service.image_decoded.emit(self.path, mtime, self.size, image)
+
+
+_service = None
+
+
+def get_thumbnail_service():
+    """
+    Returns the ThumbnailService shared by all widgets. It is created on first use, after the QApplication exists.
+    """
+
+    global _service
+    if _service is None:
+        _service = ThumbnailService()
+    return _service